@@ -2,66 +2,110 @@ import argparse
 import ctypes
 import json
 import os
+import socket
+import threading
 import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 from pathlib import Path
 from random import randint
-from typing import Optional
+from typing import Any, Optional, Union
 
-import requests
 import urllib3
-from bs4 import BeautifulSoup
+from requests import Response
 
+from libcache import HtmlCache
 from libchrome import Chrome
+from libcookie import CookieIdentity, CookieProvider
+from libdedup import DedupIndex, dedup_keys
+from libidentity import IdentityPool
+from libparser import PARSER_NAMES, Parser, RegexParser, get_parser, new_info, parse_total
+from libpipeline import Pipeline
 from liblogger import log_err, log_inf
+from libqueue import STATE_LEASED, LeaseKeeper, open_queue
+from libratelimit import HostRateLimiter
+from librefresh import RefreshIndex, hit_fingerprint, validator_headers
+from libretry import FAILURE_CHALLENGE, URL_FAILURES, DeadLetter, FetchError, HostCircuitBreaker, RetryPolicy, classify_exception, classify_response
+from libsession import SessionPool
+from libsink import COMPRESSIONS, JsonlSink
+from libsite import DEFAULT_SITE, SITES, Site, load_sites
+from libstore import DONE_MARKER_NAME, StateStore
 
 urllib3.disable_warnings()
 
-COOKIE = ""
-USER_AGENT = ""
-
 CUR_DIR = str(Path(__file__).parent.absolute())
 TEMP_DIR = os.path.join(CUR_DIR, "temp")
+COOKIE_CACHE_DIR = os.path.join(TEMP_DIR, "cookies")
 OUTPUT_DIR = os.path.join(CUR_DIR, "output")
-DONE_MARKER_NAME = "done"
+PLAN_FNAME = "plan.json"
+PROBE_LIMITS = [100, 50, 25]
+REFRESH_FNAME = "refresh.sqlite"
+DEDUP_FNAME = "dedup.sqlite"
+DEAD_LETTER_FNAME = "dead_letter.jsonl"
+
+
+RATE_LIMITER = HostRateLimiter(rate=1.0)
+SESSION_POOL = SessionPool()
+CIRCUIT_BREAKER = HostCircuitBreaker()
+# fetches that exhausted their retries, replayed by --retry-failed
+DEAD_LETTER = DeadLetter(os.path.join(OUTPUT_DIR, DEAD_LETTER_FNAME))
+# raw responses are kept here for --reextract if set
+CACHE: Optional[HtmlCache] = None
+# worker processes parsing the responses for --parse-processes if set
+PARSE_POOL: Optional[ProcessPoolExecutor] = None
+# parsers of the --reextract and --parse-processes worker processes, per site
+WORKER_PARSERS: dict[str, Parser] = {}
+WORKER_ARGS: Optional[argparse.Namespace] = None
+# fingerprints and validators of the last runs for --refresh if set
+REFRESH: Optional[RefreshIndex] = None
+# records of the companies fetched so far, by detail link and by name and address, for --dedup if set
+DEDUP: Optional[DedupIndex] = None
+# page status and records live in this store or sink instead of marker files and json files if set
+STORE: Optional[Union[StateStore, JsonlSink]] = None
 
+# fields a list page hit must carry to skip its detail page, empty means always fetch the detail page
+LIST_FIELDS: list[str] = []
+STATS_LOCK = threading.Lock()
+STATS = {
+    "detail_fetched": 0,
+    "detail_avoided": 0,
+    "detail_deduped": 0,
+    "detail_unchanged": 0,
+    "not_modified": 0,
+}
 
-CHROME = None
 
-# Nürnberg
-# HOME_URL = "https://www.hwk-mittelfranken.de/betriebe/suche-75,0,bdbsearch.html?search-searchterm=&search-filter-zipcode=90402&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-training=&search-filter-experience="
-# BASE_URL = "https://www.hwk-mittelfranken.de"
-# COOKIE_DOMAIN = ".hwk-mittelfranken.de"
-# TOTAL_PAGES = 1439
-# PAGE_SIZE = 10
+class SiteCrawl:
+    """
+    Runtime state of crawling one site: its own browser, cookie provider, parser, plan and detail workers.
+    """
 
-# Rostock
-# HOME_URL = "https://www.hwk-omv.de/betriebe/suche-18,57,bdbsearch.html?search-searchterm=&search-filter-zipcode=Rostock&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-training=&search-filter-experience="
-# BASE_URL = "https://www.hwk-omv.de"
-# COOKIE_DOMAIN = ".hwk-omv.de"
-# TOTAL_PAGES = 587
-# PAGE_SIZE = 10
+    def __init__(self, site: Site, output_dir: str):
+        self.site = site
+        self.output_dir = output_dir
+        self.page_size = site.page_size
+        self.total_pages = site.total_pages
+        self.chrome: Optional[Chrome] = None
+        self.chrome_lock = threading.Lock()
+        self.user_agent = ""
+        self.cookie_provider: Optional[Union[CookieProvider, IdentityPool]] = None
+        self.parser: Parser = get_parser(hit_selector=site.hit_selector, card_selector=site.card_selector)
+        self.detail_executor: Optional[ThreadPoolExecutor] = None
 
-# Köln
-HOME_URL = "https://www.hwk-koeln.de/betriebe/suche-32,0,bdbsearch.html?search-searchterm=&search-filter-zipcode=50667&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-experience="
-BASE_URL = "https://www.hwk-koeln.de"
-COOKIE_DOMAIN = ".hwk-koeln.de"
-TOTAL_PAGES = 2716
-PAGE_SIZE = 10
 
+def gen_page_url(crawl: SiteCrawl, page_index: int) -> str:
+    return crawl.site.gen_list_url(offset=page_index * crawl.page_size, limit=crawl.page_size)
 
-def gen_page_url(page_index: int) -> str:
-    # Nürnberg
-    # page_link = f"https://www.hwk-mittelfranken.de/betriebe/suche-75,0,bdbsearch.html?search-searchterm=&search-job=&search-local=&search-filter-zipcode=90402&search-filter-latitude=49.453333&search-filter-longitude=11.091667&search-filter-radius=250&search-filter-jobnr=&search-filter-training=&search-filter-experience=&limit={PAGE_SIZE}&offset={page_index * PAGE_SIZE}"
 
-    # Rostock
-    # page_link = f"https://www.hwk-omv.de/betriebe/suche-18,57,bdbsearch.html?limit={PAGE_SIZE}&search-searchterm=&search-job=&search-local=&search-filter-zipcode=Rostock&search-filter-radius=250&search-filter-jobnr=&search-filter-training=&search-filter-experience=&offset={page_index * PAGE_SIZE}"
+def site_url(site: Site, url: str) -> str:
+    if not url.startswith(site.base_url):
+        return site.base_url + url
+    return url
 
-    # Köln
-    page_link = f"https://www.hwk-koeln.de/betriebe/suche-32,0,bdbsearch.html?limit={PAGE_SIZE}&search-searchterm=&search-job=&search-local=&search-filter-zipcode=50667&search-filter-latitude=50.941389&search-filter-longitude=6.953611&search-filter-radius=250&search-filter-jobnr=&search-filter-experience=&offset={page_index * PAGE_SIZE}"
 
-    return page_link
+def page_dir_of(crawl: SiteCrawl, page_index: int) -> str:
+    return os.path.join(crawl.output_dir, ("page_%04d" % page_index))
 
 
 def mark_as_done(dir_path: str):
@@ -81,19 +125,81 @@ def is_done(dir_path: str) -> bool:
     return ret
 
 
-def get_cookie() -> Optional[str]:
-    cookie_header = None
-    if CHROME != None:
-        CHROME.clear_cookie()
-        while not CHROME.goto(
-            url2go=HOME_URL,
-            wait_elem_selector=".searchhit-result",
+def is_page_done(crawl: SiteCrawl, page_index: int) -> bool:
+    if STORE != None:
+        return STORE.is_done(crawl.site.name, page_index)
+    return is_done(page_dir_of(crawl, page_index))
+
+
+def mark_page_done(crawl: SiteCrawl, page_index: int):
+    if STORE != None:
+        STORE.mark_done(crawl.site.name, page_index)
+    else:
+        mark_as_done(page_dir_of(crawl, page_index))
+
+
+def pending_pages(crawl: SiteCrawl, begin_page: int, end_page: int) -> list[int]:
+    """
+    Returns the pages of the range that are not done yet, with a single query for a store.
+    """
+    if REFRESH != None:
+        return list(range(begin_page, end_page))
+    if STORE != None:
+        done_pages = STORE.done_pages(crawl.site.name)
+        return [i for i in range(begin_page, end_page) if i not in done_pages]
+    return [i for i in range(begin_page, end_page) if not is_done(page_dir_of(crawl, i))]
+
+
+def has_pages(crawl: SiteCrawl) -> bool:
+    """
+    Tells if records or done pages of the site exist already.
+    """
+    if STORE != None:
+        return STORE.has_site(crawl.site.name)
+    return os.path.isdir(crawl.output_dir) and len([fname for fname in os.listdir(crawl.output_dir) if fname.startswith("page_")]) > 0
+
+
+def save_record(crawl: SiteCrawl, page_index: int, info_index: int, info: dict[str, Any]):
+    if STORE != None:
+        STORE.put_record(crawl.site.name, page_index, info_index, info)
+    else:
+        info_fpath = os.path.join(page_dir_of(crawl, page_index), f"{info_index}.json")
+        tmp_fpath = info_fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(info, f, indent=2)
+
+        # replace, --refresh and --retry-failed write records again
+        os.replace(tmp_fpath, info_fpath)
+
+
+def get_chrome(crawl: SiteCrawl) -> Chrome:
+    # chrome is only started once a challenge has to be solved
+    with crawl.chrome_lock:
+        if crawl.chrome == None:
+            crawl.chrome = Chrome(
+                width=800 + randint(0, 200),
+                height=600 + randint(0, 100),
+                user_data_dir=os.path.join(TEMP_DIR, f"profile_{datetime.now().timestamp()}"),
+            )
+            crawl.chrome.start()
+            crawl.user_agent = crawl.chrome.run_script("navigator.userAgent")
+    return crawl.chrome
+
+
+def get_cookie(crawl: SiteCrawl) -> Optional[CookieIdentity]:
+    identity = None
+    chrome = get_chrome(crawl)
+    if chrome != None:
+        chrome.clear_cookie()
+        while not chrome.goto(
+            url2go=crawl.site.home_url,
+            wait_elem_selector=crawl.site.hit_selector,
             wait_timeout=300.0,
         ):
             pass
 
         while True:
-            cookies = CHROME.cookie(COOKIE_DOMAIN)
+            cookies = chrome.cookie(crawl.site.cookie_domain)
             if cookies != None:
                 cookie_header = ""
                 for cookie in cookies:
@@ -104,181 +210,957 @@ def get_cookie() -> Optional[str]:
                     # log_err("Cookie is empty, Retry get cookie")
                     time.sleep(0.1)
                 else:
+                    identity = CookieIdentity(cookies=cookies, user_agent=crawl.user_agent)
                     break
             else:
                 log_err("Cookie is none")
     else:
         log_err("chrome is none")
-    return cookie_header
+    return identity
 
 
-def fetch(url: str, delay: float = 1.0) -> Optional[BeautifulSoup]:
-    global COOKIE
+def use_identity(crawl: SiteCrawl, identity: CookieIdentity):
+    SESSION_POOL.set_user_agent(identity.user_agent, domain=crawl.site.cookie_domain)
+    SESSION_POOL.set_cookies(crawl.site.cookie_domain, identity.cookies)
 
-    ret = None
-    try:
-        if not url.startswith(BASE_URL):
-            url = BASE_URL + url
 
-        while True:
-            try:
-                time.sleep(delay)
-                resp = requests.get(
+def fetch_response(crawl: SiteCrawl, url: str, headers: Optional[dict[str, str]] = None) -> Response:
+    """
+    Returns the response of a successful request, a 304 answer to conditional `headers` counts as success.
+    Failures are retried with the backoff of their class, FetchError is raised once its budget is exhausted.
+    """
+    url = site_url(crawl.site, url)
+    policy = RetryPolicy()
+    limiter = RATE_LIMITER.get(url)
+    breaker = CIRCUIT_BREAKER.get(url)
+    while True:
+        breaker.wait()
+        slot = limiter.acquire()
+        identity = None
+        try:
+            identity = crawl.cookie_provider.current()
+            if identity != None:
+                resp = SESSION_POOL.get(url).get(
                     url,
-                    headers={
-                        "Cookie": COOKIE,
-                        "User-Agent": USER_AGENT,
-                    },
-                    verify=False,
+                    cookies=identity.cookie_dict(),
+                    headers={**(headers or {}), "User-Agent": identity.user_agent},
                     timeout=15.0,
                 )
+            else:
+                resp = SESSION_POOL.get(url).get(url, headers=headers, timeout=15.0)
 
-                if resp.status_code == 200:
-                    if "Just a moment..." in resp.text:
-                        log_err("cloudflare")
-                    else:
-                        ret = BeautifulSoup(resp.text, "html.parser")
-                        break
-                else:
-                    log_err(f"request error: {resp.status_code}")
+            failure = classify_response(resp.status_code, resp.text)
+            if failure == None:
+                limiter.on_success()
+                breaker.on_success()
+                if resp.status_code == 200 and CACHE != None:
+                    CACHE.put(url, resp.text)
+                return resp
+            log_err(f"request error: {resp.status_code} ({failure})")
+        except Exception as e:
+            failure = classify_exception(e)
+            log_err(f"request error: {e} ({failure})")
+
+        if failure in URL_FAILURES:
+            # the host answered, only this url is broken
+            limiter.on_success()
+        else:
+            limiter.on_failure(slot)
+            breaker.on_failure()
+
+        # only a challenge needs a new cookie
+        if failure == FAILURE_CHALLENGE:
+            crawl.cookie_provider.refresh(identity)
+
+        if not policy.on_failure(failure):
+            log_err(f"give up {url}: {failure} after {policy.attempts()} attempts")
+            raise FetchError(url, failure, policy.attempts())
+        time.sleep(policy.delay(failure))
+
+
+def fetch(crawl: SiteCrawl, url: str) -> Optional[str]:
+    try:
+        return fetch_response(crawl, url).text
+    except FetchError:
+        return None
+
+
+def park(crawl: SiteCrawl, e: FetchError, page_index: int, info_index: Optional[int] = None, hit: Optional[dict[str, Any]] = None):
+    """
+    Parks a failed list page or detail page in the dead letter file for --retry-failed.
+    """
+    DEAD_LETTER.park(
+        {
+            "site": crawl.site.name,
+            "kind": "page" if hit == None else "detail",
+            "page_index": page_index,
+            "info_index": info_index,
+            "hit": hit,
+            "url": e.url,
+            "failure": e.failure,
+            "attempts": e.attempts,
+        }
+    )
+
+
+def count_stat(key: str):
+    with STATS_LOCK:
+        STATS[key] += 1
+
+
+def count_hits(crawl: SiteCrawl, offset: int, limit: int) -> Optional[int]:
+    text = fetch(crawl, crawl.site.gen_list_url(offset=offset, limit=limit))
+    if text != None:
+        return len(crawl.parser.parse_list(text))
+    return None
+
+
+def probe_plan(crawl: SiteCrawl) -> Optional[tuple[int, int]]:
+    """
+    Detects the largest page size the search honours and the number of hits.
+    Returns page size and total page count, or None if a probe request failed.
+    """
+    page_size = crawl.site.page_size
+    text = fetch(crawl, crawl.site.gen_list_url(offset=0, limit=page_size))
+    if text == None:
+        log_err(f"{crawl.site.name} probe: failed fetch first list page")
+        return None
+    total_hits = parse_total(text)
+    log_inf(f"{crawl.site.name} probe: search reports {total_hits} hits")
 
-                log_inf("fetch new cookie")
-                COOKIE = get_cookie()
-                log_inf(f"cookie > {COOKIE}")
-            except:
-                traceback.print_exc()
+    for limit in PROBE_LIMITS:
+        if limit <= page_size:
+            break
+        hit_count = count_hits(crawl, offset=0, limit=limit)
+        if hit_count == None:
+            log_err(f"{crawl.site.name} probe: failed fetch limit={limit}")
+            return None
+        expected = min(limit, total_hits) if total_hits != None else limit
+        log_inf(f"{crawl.site.name} probe: limit={limit} > {hit_count} hits")
+        if hit_count >= expected or hit_count > page_size:
+            # a clamped limit still tells the largest page size the server honours
+            page_size = hit_count if hit_count < expected else limit
+            break
+
+    if total_hits == None:
+        # no hit count on the page, find the last non-empty offset
+        lo, hi = 0, page_size
+        while True:
+            hit_count = count_hits(crawl, offset=hi, limit=1)
+            if hit_count == None:
+                log_err(f"{crawl.site.name} probe: failed fetch offset={hi}")
+                return None
+            if hit_count == 0:
+                break
+            lo, hi = hi, hi * 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            hit_count = count_hits(crawl, offset=mid, limit=1)
+            if hit_count == None:
+                log_err(f"{crawl.site.name} probe: failed fetch offset={mid}")
+                return None
+            if hit_count > 0:
+                lo = mid
+            else:
+                hi = mid
+        total_hits = hi
+        log_inf(f"{crawl.site.name} probe: last hit at offset {lo}")
+
+    total_pages = (total_hits + page_size - 1) // page_size
+    return page_size, total_pages
+
+
+def load_plan(crawl: SiteCrawl, probe: bool) -> tuple[int, int]:
+    """
+    Returns page size and total page count of the output folder.
+    A probed plan is stored with the output so resumed runs keep the same page layout.
+    """
+    page_size, total_pages = crawl.site.page_size, crawl.site.total_pages
+    plan_fpath = os.path.join(crawl.output_dir, PLAN_FNAME)
+    try:
+        if os.path.isfile(plan_fpath):
+            with open(plan_fpath, "r") as f:
+                plan = json.load(f)
+            page_size, total_pages = plan["page_size"], plan["total_pages"]
+            log_inf(f"{crawl.site.name} plan: reuse {plan_fpath}")
+        elif probe and has_pages(crawl):
+            # pages crawled without a plan have the page size of the site, a probed size would misread them
+            log_err(f"{crawl.site.name} plan: pages exist without {PLAN_FNAME}, not probing")
+        elif probe:
+            plan = probe_plan(crawl)
+            if plan == None:
+                # a plan from a failed probe would misplace every page, so it is probed again next run
+                log_err(f"{crawl.site.name} plan: probe failed, using site defaults")
+                return page_size, total_pages
+            page_size, total_pages = plan
+            os.makedirs(crawl.output_dir, exist_ok=True)
+            tmp_fpath = plan_fpath + ".tmp"
+            with open(tmp_fpath, "w") as f:
+                json.dump({"page_size": page_size, "total_pages": total_pages}, f, indent=2)
+            os.replace(tmp_fpath, plan_fpath)
     except:
         traceback.print_exc()
-    return ret
+    log_inf(f"{crawl.site.name} plan: {total_pages} pages of {page_size} hits")
+    return page_size, total_pages
+
+
+def new_record(hit: dict[str, Any]) -> dict[str, Any]:
+    info = new_info()
+    info["name"] = hit["name"]
+    if len(LIST_FIELDS) > 0:
+        info.update(hit["info"])
+    return info
 
 
-def crawl_page(page_index: int, page_link: str):
+def is_complete(info: dict[str, Any]) -> bool:
+    """
+    Tells if the list page already carries every --list-first field, so the detail page can be skipped.
+    """
+    return len(LIST_FIELDS) > 0 and len([field for field in LIST_FIELDS if info[field] == "#"]) == 0
+
+
+def lookup_record(crawl: SiteCrawl, page_index: int, info_index: int, hit: dict[str, Any]) -> tuple[dict[str, Any], list[str], bool]:
+    """
+    Returns the record of a hit as far as it is known without its detail page,
+    its dedup keys and whether the detail page still has to be fetched.
+    """
+    if hit["link"] == None:
+        log_err("failed get link elem")
+        return new_info(), [], False
+
+    info = new_record(hit)
+    keys = dedup_keys(site_url(crawl.site, hit["link"]), hit["name"], hit["info"].get("address", "#")) if DEDUP != None else []
+    if is_complete(info):
+        log_inf(f"{crawl.site.name} page {page_index} > info {info_index} is complete on the list page")
+        count_stat("detail_avoided")
+        return info, keys, False
+
+    known_info = DEDUP.get(keys) if DEDUP != None else None
+    if known_info != None:
+        log_inf(f"{crawl.site.name} page {page_index} > info {info_index} was fetched before")
+        count_stat("detail_deduped")
+        return known_info, keys, False
+    return info, keys, True
+
+
+def fetch_detail(crawl: SiteCrawl, page_index: int, info_index: int, hit: dict[str, Any]) -> Optional[str]:
+    count_stat("detail_fetched")
     try:
-        page_dir = os.path.join(OUTPUT_DIR, ("page_%04d" % page_index))
-        os.makedirs(page_dir, exist_ok=True)
+        return fetch_response(crawl, hit["link"]).text
+    except FetchError as e:
+        log_err("failed fetch company content")
+        park(crawl, e, page_index, info_index, hit)
+    return None
+
+
+def parse_hits(crawl: SiteCrawl, text: str) -> list[dict[str, Any]]:
+    if PARSE_POOL != None:
+        return PARSE_POOL.submit(extract_list, crawl.site, text).result()
+    return crawl.parser.parse_list(text)
+
+
+def parse_details(crawl: SiteCrawl, tasks: list[tuple[str, dict[str, Any]]]) -> list[bool]:
+    """
+    Parses detail pages into their records, in one round trip to the worker processes for --parse-processes.
+    Returns per page whether it was parsed, a page failing to parse does not fail the others.
+    """
+    if PARSE_POOL != None:
+        infos = PARSE_POOL.submit(extract_details, crawl.site, tasks).result()
+        for (_, info), parsed_info in zip(tasks, infos):
+            if parsed_info != None:
+                info.update(parsed_info)
+        return [parsed_info != None for parsed_info in infos]
 
-        if is_done(page_dir):
-            log_inf(f"page {page_index} is already done")
+    ret = []
+    for text, info in tasks:
+        try:
+            crawl.parser.parse_detail(text, info)
+            ret.append(True)
+        except:
+            traceback.print_exc()
+            ret.append(False)
+    return ret
+
+
+def parse_record(crawl: SiteCrawl, text: str, info: dict[str, Any], keys: list[str]):
+    if not parse_details(crawl, [(text, info)])[0]:
+        raise ValueError("failed parse company content")
+    if DEDUP != None:
+        DEDUP.put(keys, info)
+
+
+def crawl_info(crawl: SiteCrawl, page_index: int, info_index: int, hit: dict[str, Any]):
+    log_inf(f"crawl {crawl.site.name} page {page_index} > info {info_index}")
+
+    info, keys, needs_detail = lookup_record(crawl, page_index, info_index, hit)
+    if needs_detail:
+        # fetch info
+        text = fetch_detail(crawl, page_index, info_index, hit)
+        if text != None:
+            parse_record(crawl, text, info, keys)
+
+    save_record(crawl, page_index, info_index, info)
+
+
+def refresh_info(crawl: SiteCrawl, page_index: int, info_index: int, hit: dict[str, Any]) -> bool:
+    """
+    Writes the record of a hit, only fetching its detail page if the hit is new or changed on the list page.
+    Returns False if the detail page failed, the former record is kept then.
+    """
+    if hit["link"] == None:
+        crawl_info(crawl, page_index, info_index, hit)
+        return True
+
+    link = site_url(crawl.site, hit["link"])
+    fingerprint = hit_fingerprint(hit)
+    known = REFRESH.get(link)
+    etag, last_modified = "", ""
+    if known != None:
+        etag, last_modified = known.etag, known.last_modified
+
+    if known != None and known.fingerprint == fingerprint:
+        info = known.info
+        count_stat("detail_unchanged")
+    else:
+        log_inf(f"crawl {crawl.site.name} page {page_index} > info {info_index} ({'changed' if known != None else 'new'})")
+        info = new_record(hit)
+        if is_complete(info):
+            count_stat("detail_avoided")
         else:
-            log_inf(f"page {page_index} > {page_link}")
+            count_stat("detail_fetched")
+            headers = validator_headers(etag, last_modified) if known != None else None
+            resp = None
+            try:
+                resp = fetch_response(crawl, link, headers=headers)
+            except FetchError as e:
+                log_err("failed fetch company content")
+                park(crawl, e, page_index, info_index, hit)
 
-            # fetch company list
-            soup = fetch(page_link)
-            if soup != None:
-                result_elems = soup.select(".searchhit-result")
-                for i, result_elem in enumerate(result_elems):
-                    log_inf(f"crawl page {page_index} > info {i}")
-
-                    info_fpath = os.path.join(page_dir, f"{i}.json")
-                    if os.path.isfile(info_fpath):
-                        log_inf(f"page {page_index} > info {i} is already done")
-                        continue
-                    info = {
-                        "name": "#",
-                        "address": "#",
-                        "email": "#",
-                        "telephone": "#",
-                        "mobile": "#",
-                        "fax": "#",
-                    }
-                    link_elem = result_elem.select_one("a")
-                    if link_elem != None:
-                        info_link = link_elem.attrs["href"]
-                        name = link_elem.text.strip()
-                        info["name"] = name
-
-                        # fetch info
-                        soup = fetch(info_link)
-                        if soup != None:
-                            cards = soup.select(".container.content>div.row:nth-child(2)>div.col-md-3")
-
-                            # address
-                            p_elem = cards[0].select_one("p")
-                            if p_elem != None:
-                                content = p_elem.decode_contents()
-                                words = content.split("<br/>")
-                                street = words[1].strip()
-                                zip = words[2].split(" ", 1)[0].strip()
-                                city = words[2].split(" ", 1)[1].strip()
-                                address = f"{city} {street}"
-                                info["address"] = address
-                            else:
-                                log_err("p_elem is none")
-
-                            if len(cards) > 1:
-                                p_elem = cards[1].select_one("p")
-                                if p_elem != None:
-                                    # email
-                                    email_elem = p_elem.select_one("a.mail")
-                                    if email_elem != None:
-                                        email = email_elem.text.strip()
-                                        info["email"] = email.replace("--at--", "@")
-                                    else:
-                                        log_err("email elem is none")
-
-                                    # phone
-                                    contact = p_elem.decode_contents()
-                                    words = contact.split("<br/>")
-                                    for word in words:
-                                        word = word.lower().strip()
-                                        if word.startswith("telefon"):
-                                            info["telephone"] = word.replace("telefon", "").strip()
-                                        elif word.startswith("handy"):
-                                            info["mobile"] = word.replace("handy", "").strip()
-                                        elif word.startswith("fax"):
-                                            info["fax"] = word.replace("fax", "").strip()
-                                else:
-                                    log_err("p_elem is none")
-                            else:
-                                log_err("no contact")
-                        else:
-                            log_err("failed fetch company content")
-                    else:
-                        log_err("failed get link elem")
+            # a detail page failing to parse is handled like one failing to fetch
+            if resp != None and resp.status_code != 304 and not parse_details(crawl, [(resp.text, info)])[0]:
+                resp = None
+
+            if resp == None:
+                # the index keeps the former fingerprint, so the next refresh fetches the detail page again
+                if known != None:
+                    info = known.info
+                save_record(crawl, page_index, info_index, info)
+                return False
+            if resp.status_code == 304:
+                # the detail page did not change, only what the list page shows
+                count_stat("not_modified")
+                info = dict(known.info)
+                info["name"] = hit["name"]
+            else:
+                etag, last_modified = resp.headers.get("ETag", ""), resp.headers.get("Last-Modified", "")
 
-                    tmp_fpath = info_fpath + ".tmp"
-                    with open(tmp_fpath, "w") as f:
-                        json.dump(info, f, indent=2)
+    REFRESH.put(link, fingerprint, info, etag=etag, last_modified=last_modified)
+    save_record(crawl, page_index, info_index, info)
+    return True
 
-                    os.rename(tmp_fpath, info_fpath)
+
+def refresh_page(crawl: SiteCrawl, page_index: int, page_link: str) -> bool:
+    """
+    Crawls a page again whether it is done or not, revalidating the list page and reusing unchanged records.
+    Returns False if the page failed unexpectedly.
+    """
+    try:
+        url = site_url(crawl.site, page_link)
+        log_inf(f"refresh {crawl.site.name} page {page_index} > {url}")
+        if STORE == None:
+            os.makedirs(page_dir_of(crawl, page_index), exist_ok=True)
+
+        links = REFRESH.page_links(url)
+        try:
+            resp = fetch_response(crawl, url, headers=REFRESH.page_headers(url) if links != None else None)
+            if resp.status_code == 304 and is_page_done(crawl, page_index):
+                log_inf(f"{crawl.site.name} page {page_index} is not modified")
+                count_stat("not_modified")
+                REFRESH.touch_page(url)
+                return True
+            if resp.status_code == 304:
+                # the records of the page are gone, fetch the page in full
+                resp = fetch_response(crawl, url)
+        except FetchError as e:
+            log_err("failed fetch page content")
+            park(crawl, e, page_index)
+            return True
+
+        jobs = []
+        refreshed = []
+        hits = parse_hits(crawl, resp.text)
+        for i, hit in enumerate(hits):
+            if crawl.detail_executor != None:
+                jobs.append(crawl.detail_executor.submit(refresh_info, crawl, page_index, i, hit))
             else:
+                refreshed.append(refresh_info(crawl, page_index, i, hit))
+
+        wait(jobs)
+        for job in jobs:
+            refreshed.append(job.result())
+
+        # with a failed detail page the list page must not answer 304 next time, its hits are checked again
+        if False not in refreshed:
+            REFRESH.put_page(url, resp.headers, [site_url(crawl.site, hit["link"]) for hit in hits if hit["link"] != None])
+        mark_page_done(crawl, page_index)
+        return True
+    except:
+        traceback.print_exc()
+    return False
+
+
+def saved_record_indices(crawl: SiteCrawl, page_index: int) -> set[int]:
+    """
+    Returns the indices of the records of a page written by an earlier run, creating the page folder.
+    """
+    if STORE != None:
+        return STORE.record_indices(crawl.site.name, page_index)
+
+    page_dir = page_dir_of(crawl, page_index)
+    os.makedirs(page_dir, exist_ok=True)
+    return set([int(fname[:-5]) for fname in os.listdir(page_dir) if fname.endswith(".json")])
+
+
+def crawl_page(crawl: SiteCrawl, page_index: int, page_link: str) -> bool:
+    """
+    Crawls the records of a page and marks it as done, a page whose list fetch failed is parked instead.
+    Returns False if the page failed unexpectedly.
+    """
+    if REFRESH != None:
+        return refresh_page(crawl, page_index, page_link)
+
+    try:
+        if is_page_done(crawl, page_index):
+            log_inf(f"{crawl.site.name} page {page_index} is already done")
+        else:
+            log_inf(f"{crawl.site.name} page {page_index} > {page_link} ({RATE_LIMITER.rate(page_link) or 0.0:.2f} req/s)")
+
+            saved_indices = saved_record_indices(crawl, page_index)
+
+            # fetch company list
+            try:
+                text = fetch_response(crawl, page_link).text
+            except FetchError as e:
+                # not done, a later run or --retry-failed crawls it again
                 log_err("failed fetch page content")
-        mark_as_done(page_dir)
+                park(crawl, e, page_index)
+                return True
+
+            jobs = []
+            hits = parse_hits(crawl, text)
+            for i, hit in enumerate(hits):
+                if i in saved_indices:
+                    log_inf(f"{crawl.site.name} page {page_index} > info {i} is already done")
+                    continue
+
+                if crawl.detail_executor != None:
+                    jobs.append(crawl.detail_executor.submit(crawl_info, crawl, page_index, i, hit))
+                else:
+                    crawl_info(crawl, page_index, i, hit)
+
+            # the page is only marked as done when every record has been written
+            wait(jobs)
+            for job in jobs:
+                job.result()
+        mark_page_done(crawl, page_index)
+        return True
     except:
         traceback.print_exc()
+    return False
+
+
+def setup(args: argparse.Namespace):
+    """
+    Creates the state shared by every site of this process.
+    """
+    global RATE_LIMITER, SESSION_POOL, CIRCUIT_BREAKER, DEAD_LETTER, LIST_FIELDS, STORE, CACHE, REFRESH, DEDUP, PARSE_POOL
+
+    LIST_FIELDS = args.list_fields
+    SESSION_POOL = SessionPool(pool_size=max(args.pool_size, args.concurrency))
+    RATE_LIMITER = HostRateLimiter(rate=args.rate, min_rate=args.min_rate, max_rate=args.max_rate)
+    CIRCUIT_BREAKER = HostCircuitBreaker(threshold=args.breaker_threshold, cooldown=args.breaker_cooldown)
+    DEAD_LETTER = DeadLetter(os.path.join(OUTPUT_DIR, DEAD_LETTER_FNAME))
+    if args.cache_dir != "":
+        CACHE = HtmlCache(args.cache_dir, max_bytes=int(args.cache_size * (1 << 20)))
+    if args.refresh and REFRESH == None:
+        REFRESH = RefreshIndex(os.path.join(OUTPUT_DIR, REFRESH_FNAME))
+    if args.dedup and DEDUP == None:
+        DEDUP = DedupIndex(os.path.join(OUTPUT_DIR, DEDUP_FNAME))
+    if args.store != "" and STORE == None:
+        STORE = StateStore(args.store)
+    if args.sink != "" and STORE == None:
+        # one shard per process, so several processes can share the folder
+        STORE = JsonlSink(
+            output_dir=args.sink,
+            shard=f"{socket.gethostname()}-{os.getpid()}",
+            compression=args.compress,
+            fsync=args.fsync,
+        )
+    if args.parse_processes > 0 and not args.reextract and PARSE_POOL == None:
+        PARSE_POOL = ProcessPoolExecutor(max_workers=args.parse_processes, initializer=init_parse_worker, initargs=(args,))
+
+
+def teardown():
+    global STORE, REFRESH, DEDUP, PARSE_POOL
+
+    SESSION_POOL.close()
+    if PARSE_POOL != None:
+        PARSE_POOL.shutdown()
+        PARSE_POOL = None
+    if STORE != None:
+        STORE.close()
+        STORE = None
+    if REFRESH != None:
+        REFRESH.close()
+        REFRESH = None
+    if DEDUP != None:
+        DEDUP.close()
+        DEDUP = None
+
+
+def open_site(crawl: SiteCrawl, args: argparse.Namespace):
+    site = crawl.site
+    crawl.parser = get_parser(
+        name=args.parser,
+        strain=args.strain,
+        fast_path=args.fast_path,
+        hit_selector=site.hit_selector,
+        card_selector=site.card_selector,
+    )
+
+    if args.identities > 0:
+        crawl.cookie_provider = IdentityPool(
+            domain=site.cookie_domain,
+            solve=lambda: get_cookie(crawl),
+            cache_dir=COOKIE_CACHE_DIR,
+            size=args.identities,
+            ttl=args.cookie_ttl,
+        )
+        crawl.cookie_provider.load()
+        crawl.cookie_provider.start()
+    else:
+        crawl.cookie_provider = CookieProvider(
+            domain=site.cookie_domain,
+            solve=lambda: get_cookie(crawl),
+            cache_dir=COOKIE_CACHE_DIR,
+            ttl=args.cookie_ttl,
+            on_change=lambda identity: use_identity(crawl, identity),
+        )
+        crawl.cookie_provider.load()
+
+    crawl.page_size, crawl.total_pages = load_plan(crawl, probe=args.probe)
+
+    if args.concurrency > 1 and not args.pipeline:
+        crawl.detail_executor = ThreadPoolExecutor(max_workers=args.concurrency)
+
+
+def close_site(crawl: SiteCrawl):
+    if crawl.detail_executor != None:
+        crawl.detail_executor.shutdown()
+        crawl.detail_executor = None
 
+    if isinstance(crawl.cookie_provider, IdentityPool):
+        crawl.cookie_provider.stop()
+    if isinstance(crawl.parser, RegexParser) and PARSE_POOL == None:
+        log_inf(f"{crawl.site.name} regex fast path: {crawl.parser.hit_count} pages, {crawl.parser.fallback_count} fallbacks to dom")
 
-def work(start: int, count: int):
+    if crawl.chrome != None:
+        crawl.chrome.quit()
+        crawl.chrome = None
+
+
+def site_output_dir(site: Site, args: argparse.Namespace) -> str:
+    if args.site_dirs:
+        return os.path.join(OUTPUT_DIR, site.name)
+    return OUTPUT_DIR
+
+
+def work_queue(crawl: SiteCrawl, args: argparse.Namespace, begin_page: int, end_page: int):
+    """
+    Crawls the pages this node leases from the shared queue until no page of the site is left.
+    """
+    queue = open_queue(args.queue, lease_time=args.lease_time)
+    added = queue.add(crawl.site.name, list(range(begin_page, end_page)))
+    log_inf(f"{crawl.site.name}: {added} pages added to {args.queue}, node {args.node}")
+
+    keeper = LeaseKeeper(queue, interval=args.lease_time / 3.0)
+    keeper.start()
+
+    def work_leases():
+        while True:
+            lease = queue.lease(crawl.site.name, args.node)
+            if lease == None:
+                if queue.stats(crawl.site.name)[STATE_LEASED] == 0:
+                    break
+                # pages leased by other nodes come back to the queue if their node dies
+                time.sleep(min(args.lease_time / 3.0, 30.0))
+                continue
+
+            keeper.hold(lease)
+            handled = crawl_page(crawl, lease.page_index, gen_page_url(crawl, lease.page_index))
+            keeper.drop(lease)
+            if not handled:
+                queue.release(lease)
+            elif is_page_done(crawl, lease.page_index):
+                # the records must be committed before other nodes consider the page done
+                if STORE != None:
+                    STORE.flush()
+                queue.complete(lease)
+            else:
+                # the list page was parked, another node may be able to fetch it
+                queue.fail(lease)
+
+    threads = [threading.Thread(target=work_leases) for _ in range(max(args.page_concurrency, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    keeper.stop()
+
+
+def retry_failed(crawl: SiteCrawl):
+    """
+    Replays the parked fetches of the site, fetches failing again are parked again.
+    An entry leaves the dead letter file only once it was replayed, so a crash keeps the rest for the next run.
+    """
+    entries = DEAD_LETTER.entries(crawl.site.name)
+    log_inf(f"{crawl.site.name}: replay {len(entries)} failed fetches")
+
+    replayed = []
+    jobs = {}
+    for entry in entries:
+        page_index = entry["page_index"]
+        try:
+            if entry["kind"] == "page":
+                if crawl_page(crawl, page_index, gen_page_url(crawl, page_index)):
+                    replayed.append(entry)
+                continue
+
+            if STORE == None:
+                os.makedirs(page_dir_of(crawl, page_index), exist_ok=True)
+            if crawl.detail_executor != None:
+                jobs[crawl.detail_executor.submit(crawl_info, crawl, page_index, entry["info_index"], entry["hit"])] = entry
+            else:
+                crawl_info(crawl, page_index, entry["info_index"], entry["hit"])
+                replayed.append(entry)
+        except:
+            traceback.print_exc()
+
+    wait(jobs)
+    for job, entry in jobs.items():
+        try:
+            job.result()
+            replayed.append(entry)
+        except:
+            traceback.print_exc()
+
+    # the records of the replay must be written before their entries are dropped
+    if STORE != None:
+        STORE.flush()
+    DEAD_LETTER.remove(replayed)
+    log_inf(f"{crawl.site.name}: replayed {len(replayed)} of {len(entries)} failed fetches")
+
+
+def pipeline_site(crawl: SiteCrawl, args: argparse.Namespace, page_indices: list[int]):
+    """
+    Crawls the pages in stages connected by bounded queues: list fetchers, detail fetchers, parsers and one writer.
+    A page is marked as done by the writer once its last record is written.
+    """
+    pages_lock = threading.Lock()
+    pending_records: dict[int, int] = {}
+    failed_pages: set[int] = set()
+
+    def fetch_list(page_index: int):
+        page_link = gen_page_url(crawl, page_index)
+        log_inf(f"{crawl.site.name} page {page_index} > {page_link} ({RATE_LIMITER.rate(page_link) or 0.0:.2f} req/s)")
+        saved_indices = saved_record_indices(crawl, page_index)
+        try:
+            text = fetch_response(crawl, page_link).text
+        except FetchError as e:
+            log_err("failed fetch page content")
+            park(crawl, e, page_index)
+            return
+
+        hits = [(i, hit) for i, hit in enumerate(parse_hits(crawl, text)) if i not in saved_indices]
+        with pages_lock:
+            pending_records[page_index] = len(hits)
+        if len(hits) == 0:
+            writer.put((page_index, None, None))
+        for i, hit in hits:
+            fetchers.put((page_index, i, hit))
+
+    def fetch_info(task: tuple[int, int, dict[str, Any]]):
+        page_index, info_index, hit = task
+        log_inf(f"crawl {crawl.site.name} page {page_index} > info {info_index}")
+        info, keys, needs_detail = lookup_record(crawl, page_index, info_index, hit)
+        text = fetch_detail(crawl, page_index, info_index, hit) if needs_detail else None
+        if text != None:
+            parsers.put((page_index, info_index, info, keys, text))
+        else:
+            writer.put((page_index, info_index, info))
+
+    def parse_info(tasks: list[tuple[int, int, dict[str, Any], list[str], str]]):
+        parsed = parse_details(crawl, [(text, info) for _, _, info, _, text in tasks])
+        for (page_index, info_index, info, keys, _), ok in zip(tasks, parsed):
+            if not ok:
+                # no record, the page is left undone for a later run
+                writer.put((page_index, info_index, None))
+                continue
+            if DEDUP != None:
+                DEDUP.put(keys, info)
+            writer.put((page_index, info_index, info))
+
+    def write_info(task: tuple[int, Optional[int], Optional[dict[str, Any]]]):
+        page_index, info_index, info = task
+        if info != None:
+            save_record(crawl, page_index, info_index, info)
+        with pages_lock:
+            if info_index != None:
+                pending_records[page_index] -= 1
+                if info == None:
+                    failed_pages.add(page_index)
+            done = pending_records[page_index] == 0
+            if done:
+                del pending_records[page_index]
+                done = page_index not in failed_pages
+        if done:
+            mark_page_done(crawl, page_index)
+
+    pipeline = Pipeline()
+    lists = pipeline.add("list", fetch_list, workers=args.page_concurrency, queue_size=args.stage_queue_size)
+    fetchers = pipeline.add("detail", fetch_info, workers=args.concurrency, queue_size=args.stage_queue_size)
+    # every parse worker waits for one batch of the parse processes at a time
+    parsers = pipeline.add(
+        "parse",
+        parse_info,
+        workers=max(args.parse_workers, args.parse_processes),
+        queue_size=args.stage_queue_size,
+        batch_size=args.parse_batch if PARSE_POOL != None else 1,
+    )
+    writer = pipeline.add("write", write_info, workers=1, queue_size=args.stage_queue_size)
+    pipeline.start()
+
+    def feed():
+        for page_index in page_indices:
+            lists.put(page_index)
+        pipeline.close()
+
+    threading.Thread(target=feed, daemon=True).start()
+    while not pipeline.join(timeout=30.0):
+        log_inf(f"{crawl.site.name} pipeline: {pipeline.describe()}")
+    log_inf(f"{crawl.site.name} pipeline: {pipeline.describe()}")
+
+
+def work_site(crawl: SiteCrawl, args: argparse.Namespace):
     try:
-        global CHROME, USER_AGENT
+        open_site(crawl, args)
+
+        begin_page = args.start
+        end_page = min(crawl.total_pages, args.start + args.count)
+        if args.count == 0:
+            end_page = crawl.total_pages
 
-        begin_page = start
-        end_page = min(TOTAL_PAGES, start + count)
-        if count == 0:
-            end_page = TOTAL_PAGES
+        log_inf(f"{crawl.site.name}: From {begin_page} page To {end_page} page > {crawl.output_dir}")
+
+        if args.retry_failed:
+            retry_failed(crawl)
+        elif args.queue != "":
+            work_queue(crawl, args, begin_page, end_page)
+        else:
+            page_indices = pending_pages(crawl, begin_page, end_page)
+            log_inf(f"{crawl.site.name}: {end_page - begin_page - len(page_indices)} pages already done")
+            if args.pipeline:
+                pipeline_site(crawl, args, page_indices)
+            elif args.page_concurrency > 1:
+                with ThreadPoolExecutor(max_workers=args.page_concurrency) as page_executor:
+                    for i in page_indices:
+                        page_executor.submit(crawl_page, crawl, i, gen_page_url(crawl, i))
+            else:
+                for i in page_indices:
+                    crawl_page(crawl, page_index=i, page_link=gen_page_url(crawl, i))
+
+        close_site(crawl)
+        log_inf(f"{crawl.site.name}: done.")
+    except:
+        traceback.print_exc()
 
-        log_inf(f"From {begin_page} page To {end_page} page")
-        ctypes.windll.kernel32.SetConsoleTitleW(f"From {begin_page} page To {end_page} page")
 
-        CHROME = Chrome(
-            width=800 + randint(0, 200),
-            height=600 + randint(0, 100),
-            user_data_dir=os.path.join(TEMP_DIR, f"profile_{datetime.now().timestamp()}"),
+def init_parse_worker(args: argparse.Namespace):
+    global WORKER_ARGS
+
+    WORKER_ARGS = args
+
+
+def worker_parser(site: Site) -> Parser:
+    parser = WORKER_PARSERS.get(site.name)
+    if parser == None:
+        parser = get_parser(
+            name=WORKER_ARGS.parser,
+            strain=WORKER_ARGS.strain,
+            fast_path=WORKER_ARGS.fast_path,
+            hit_selector=site.hit_selector,
+            card_selector=site.card_selector,
         )
-        CHROME.start()
-        USER_AGENT = CHROME.run_script("navigator.userAgent")
+        WORKER_PARSERS[site.name] = parser
+    return parser
+
+
+def extract_list(site: Site, text: str) -> list[dict[str, Any]]:
+    """
+    Parses the hits of a list page, in a worker process.
+    """
+    return worker_parser(site).parse_list(text)
+
+
+def extract_details(site: Site, tasks: list[tuple[str, dict[str, Any]]]) -> list[Optional[dict[str, Any]]]:
+    """
+    Parses detail pages into their records, in a worker process. Only the records travel back,
+    None for a page that failed to parse.
+    """
+    parser = worker_parser(site)
+    ret = []
+    for text, info in tasks:
+        try:
+            parser.parse_detail(text, info)
+            ret.append(info)
+        except:
+            traceback.print_exc()
+            ret.append(None)
+    return ret
+
+
+def init_reextract(args: argparse.Namespace):
+    global LIST_FIELDS, CACHE
+
+    init_parse_worker(args)
+    LIST_FIELDS = args.list_fields
+    CACHE = HtmlCache(args.cache_dir, max_bytes=int(args.cache_size * (1 << 20)))
+
+
+def reextract_page(site: Site, page_size: int, page_index: int) -> Optional[list[Optional[dict[str, Any]]]]:
+    """
+    Extracts the records of a page from cached responses only, in a worker process.
+    Returns None if the list page is not cached. The record of a hit whose detail page is not cached
+    or fails to parse is None.
+    """
+    parser = worker_parser(site)
+    text = CACHE.get(site.gen_list_url(offset=page_index * page_size, limit=page_size))
+    if text == None:
+        return None
+
+    infos = []
+    for hit in parser.parse_list(text):
+        info = new_info()
+        if hit["link"] != None:
+            info = new_record(hit)
+            if not is_complete(info):
+                detail_text = CACHE.get(site_url(site, hit["link"]))
+                try:
+                    if detail_text != None:
+                        parser.parse_detail(detail_text, info)
+                    else:
+                        info = None
+                except:
+                    traceback.print_exc()
+                    info = None
+        infos.append(info)
+    return infos
+
+
+def reextract(args: argparse.Namespace):
+    """
+    Rebuilds the records of the selected pages from the response cache, without any request.
+    Pages are parsed in worker processes and written by this process.
+    """
+    workers = args.reextract_workers if args.reextract_workers > 0 else os.cpu_count()
+    log_inf(f"reextract: from {args.cache_dir} with {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_reextract, initargs=(args,)) as executor:
+        for site in args.sites:
+            crawl = SiteCrawl(site=site, output_dir=site_output_dir(site, args))
+            crawl.page_size, crawl.total_pages = load_plan(crawl, probe=False)
+
+            begin_page = args.start
+            end_page = min(crawl.total_pages, args.start + args.count)
+            if args.count == 0:
+                end_page = crawl.total_pages
+
+            jobs = {executor.submit(reextract_page, site, crawl.page_size, i): i for i in range(begin_page, end_page)}
+            page_count, record_count, uncached_pages, uncached_details = 0, 0, 0, 0
+            for job in as_completed(jobs):
+                page_index = jobs[job]
+                try:
+                    infos = job.result()
+                    if infos == None:
+                        uncached_pages += 1
+                        continue
 
-        for i in range(begin_page, end_page):
-            crawl_page(page_index=i, page_link=gen_page_url(i))
+                    if STORE == None:
+                        os.makedirs(page_dir_of(crawl, page_index), exist_ok=True)
+                    # a record whose detail page is not cached or unparsable keeps whatever the crawl saved
+                    missing_count = len([info for info in infos if info == None])
+                    for i, info in enumerate(infos):
+                        if info != None:
+                            save_record(crawl, page_index, i, info)
+                    # a page missing records stays as it was, a crawl fetches the missing ones
+                    if missing_count == 0:
+                        mark_page_done(crawl, page_index)
+                    page_count += 1
+                    record_count += len(infos) - missing_count
+                    uncached_details += missing_count
+                except:
+                    traceback.print_exc()
+            log_inf(
+                f"{site.name} reextract: {page_count} pages, {record_count} records, "
+                + f"{uncached_pages} list pages and {uncached_details} detail pages not cached or unparsable"
+            )
 
-        CHROME.quit()
+
+def work(args: argparse.Namespace):
+    try:
+        log_inf(f"parser: {args.parser}{' (restricted subtree)' if args.strain else ''}{' with regex fast path' if args.fast_path else ''}")
+        if len(args.list_fields) > 0:
+            log_inf(f"list first: detail pages are only fetched when one of {args.list_fields} is missing")
+        if args.identities > 0:
+            log_inf(f"identities: keep {args.identities} identities warm per site")
+        log_inf(f"rate: {args.rate} req/s per host, adapting in [{args.min_rate}, {args.max_rate}]")
+        if args.concurrency > 1:
+            log_inf(f"concurrency: {args.concurrency} detail workers, {args.page_concurrency} pages per site")
+        if args.parse_processes > 0:
+            log_inf(f"parse: {args.parse_processes} worker processes")
+
+        setup(args)
+        if args.reextract:
+            reextract(args)
+            teardown()
+            log_inf("All done.")
+            return
+
+        site_names = ", ".join([site.name for site in args.sites])
+        ctypes.windll.kernel32.SetConsoleTitleW(f"{site_names} From {args.start} page, {args.count} pages")
+
+        # every site gets its own browser, cookie provider and workers, rate limits are per host
+        threads = []
+        for site in args.sites:
+            crawl = SiteCrawl(site=site, output_dir=site_output_dir(site, args))
+            thread = threading.Thread(target=work_site, args=(crawl, args))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        log_inf(
+            f"detail pages: {STATS['detail_fetched']} fetched, {STATS['detail_avoided']} avoided, {STATS['detail_deduped']} fetched before"
+        )
+        if args.refresh:
+            log_inf(f"refresh: {STATS['detail_unchanged']} hits unchanged, {STATS['not_modified']} pages not modified")
+
+        teardown()
         log_inf("All done.")
     except:
         traceback.print_exc()
 
 
-def main():
-    global STATE, FROM_CITY, CITY_COUNT
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--start",
@@ -296,9 +1178,325 @@ def main():
         required=False,
         help="Page count. Default is 0 which means all the following pages.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of detail pages fetched in parallel. Default is 1 which means sequential crawling.",
+    )
+    parser.add_argument(
+        "--page-concurrency",
+        dest="page_concurrency",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of list pages crawled in parallel. Default is 1.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        required=False,
+        help="Crawl in stages connected by bounded queues: --page-concurrency list fetchers, --concurrency detail fetchers, --parse-workers parsers and one writer.",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        dest="parse_workers",
+        type=int,
+        default=2,
+        required=False,
+        help="Number of detail page parsers of --pipeline. Default is 2.",
+    )
+    parser.add_argument(
+        "--parse-processes",
+        dest="parse_processes",
+        type=int,
+        default=0,
+        required=False,
+        help="Parse list and detail pages in this many worker processes instead of the crawling threads, to use more than one core. Default is 0 which means no worker processes.",
+    )
+    parser.add_argument(
+        "--parse-batch",
+        dest="parse_batch",
+        type=int,
+        default=16,
+        required=False,
+        help="Detail pages --pipeline sends to the --parse-processes workers at once. Default is 16.",
+    )
+    parser.add_argument(
+        "--stage-queue-size",
+        dest="stage_queue_size",
+        type=int,
+        default=100,
+        required=False,
+        help="Items buffered in front of every --pipeline stage before the stage before it waits. Default is 100.",
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        type=float,
+        default=1.0,
+        required=False,
+        help="Initial request rate per host in requests per second, shared by all workers. Default is 1.0.",
+    )
+    parser.add_argument(
+        "--min-rate",
+        dest="min_rate",
+        type=float,
+        default=0.1,
+        required=False,
+        help="Lowest request rate per host the limiter backs off to. Default is 0.1.",
+    )
+    parser.add_argument(
+        "--max-rate",
+        dest="max_rate",
+        type=float,
+        default=10.0,
+        required=False,
+        help="Highest request rate per host the limiter ramps up to. Use --max-rate equal to --rate for a fixed rate. Default is 10.0.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        dest="pool_size",
+        type=int,
+        default=10,
+        required=False,
+        help="Number of keep-alive connections kept per host. Never less than --concurrency. Default is 10.",
+    )
+    parser.add_argument(
+        "--cookie-ttl",
+        dest="cookie_ttl",
+        type=float,
+        default=3600.0,
+        required=False,
+        help="Seconds a solved cookie is reused, also across restarts. Default is 3600.",
+    )
+    parser.add_argument(
+        "--identities",
+        dest="identities",
+        type=int,
+        default=0,
+        required=False,
+        help="Number of cookie/user agent identities kept warm in the background and used round-robin. Default is 0 which means a single identity refreshed on demand.",
+    )
+    parser.add_argument(
+        "--parser",
+        dest="parser",
+        choices=PARSER_NAMES,
+        default="html.parser",
+        required=False,
+        help="HTML parser backend. html.parser is the BeautifulSoup reference, lxml uses the lxml tree builder of BeautifulSoup, lxml-tree extracts on a plain lxml tree. Default is html.parser.",
+    )
+    parser.add_argument(
+        "--strain",
+        dest="strain",
+        action="store_true",
+        required=False,
+        help="Only parse the hit blocks of list pages and the content container of detail pages (BeautifulSoup backends).",
+    )
+    parser.add_argument(
+        "--fast-path",
+        dest="fast_path",
+        action="store_true",
+        required=False,
+        help="Extract the detail contact card with regular expressions and only fall back to the --parser backend when validation fails.",
+    )
+    parser.add_argument(
+        "--list-first",
+        dest="list_fields",
+        type=str,
+        default="",
+        required=False,
+        help="Comma separated fields (address,email,telephone,mobile,fax) that the list page hit must carry to skip its detail page, e.g. address,email,telephone. Default is empty which means every detail page is fetched.",
+    )
+    parser.add_argument(
+        "--probe",
+        dest="probe",
+        action="store_true",
+        required=False,
+        help="Probe the largest page size and the hit count of the search before crawling, --start/--count are then pages of the probed size. The plan is saved in the output folder and reused on resume.",
+    )
+    parser.add_argument(
+        "--sites",
+        dest="sites",
+        type=str,
+        default="",
+        required=False,
+        help=f"Comma separated site profiles crawled in parallel, each into output/<site>. Known sites: {', '.join(SITES.keys())}. Default is {DEFAULT_SITE} into output.",
+    )
+    parser.add_argument(
+        "--site-file",
+        dest="site_file",
+        type=str,
+        default="",
+        required=False,
+        help="JSON file with a list of additional or overriding site profiles.",
+    )
+    parser.add_argument(
+        "--queue",
+        dest="queue",
+        type=str,
+        default="",
+        required=False,
+        help="Shared page queue, a SQLite file for several processes on this host or http://<host>:<port> of libqueue.py for several hosts. Pages of --start/--count are added once and every node crawls the pages it leases. Default is empty which means no queue.",
+    )
+    parser.add_argument(
+        "--node",
+        dest="node",
+        type=str,
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        required=False,
+        help="Name of this node in the queue. Default is <hostname>-<pid>.",
+    )
+    parser.add_argument(
+        "--lease-time",
+        dest="lease_time",
+        type=float,
+        default=300.0,
+        required=False,
+        help="Seconds a leased page stays with this node without heartbeat before other nodes reclaim it, for a SQLite --queue. Default is 300.",
+    )
+    parser.add_argument(
+        "--store",
+        dest="store",
+        type=str,
+        default="",
+        required=False,
+        help="SQLite file holding page status and records of every site, e.g. output/crawl.sqlite, instead of page_XXXX folders. Export it with libstore.py. Default is empty which means page_XXXX folders.",
+    )
+    parser.add_argument(
+        "--sink",
+        dest="sink",
+        type=str,
+        default="",
+        required=False,
+        help="Folder of JSONL segments that records and finished pages of every site are appended to, e.g. output/jsonl, instead of page_XXXX folders. merge_result.py reads it directly. Default is empty which means page_XXXX folders.",
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        choices=list(COMPRESSIONS.keys()),
+        default="gzip",
+        required=False,
+        help="Compression of the --sink segments, zstd needs the zstandard package. Default is gzip.",
+    )
+    parser.add_argument(
+        "--fsync",
+        dest="fsync",
+        action="store_true",
+        required=False,
+        help="Fsync every batch written to the --sink segments instead of only full segments.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=str,
+        default="",
+        required=False,
+        help="Folder keeping the compressed raw list and detail responses, e.g. temp/html. Default is empty which means no cache.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=float,
+        default=2048.0,
+        required=False,
+        help="Size of the --cache-dir in MB before the least recently used responses are evicted. Default is 2048.",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        dest="breaker_threshold",
+        type=int,
+        default=10,
+        required=False,
+        help="Consecutive failures of a host that hold all its requests for --breaker-cooldown seconds. Default is 10.",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        dest="breaker_cooldown",
+        type=float,
+        default=30.0,
+        required=False,
+        help="Seconds requests to a failing host are held, doubled while the host keeps failing, up to 600. Default is 30.",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        dest="retry_failed",
+        action="store_true",
+        required=False,
+        help="Only replay the list and detail pages that exhausted their retries and were parked in output/dead_letter.jsonl.",
+    )
+    parser.add_argument(
+        "--dedup",
+        dest="dedup",
+        action="store_true",
+        required=False,
+        help="Fetch every company once across pages, sites and runs: a hit whose detail link, or name and address, was fetched before reuses that record. The index is kept in output/dedup.sqlite.",
+    )
+    parser.add_argument(
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        required=False,
+        help="Crawl the pages of --start/--count again even if they are done, revalidating list and detail pages with ETag/Last-Modified and only fetching the detail pages of new or changed hits. Fingerprints and last seen times are kept in output/refresh.sqlite, the first refresh run fills it.",
+    )
+    parser.add_argument(
+        "--reextract",
+        dest="reextract",
+        action="store_true",
+        required=False,
+        help="Rebuild the records of --start/--count from --cache-dir only, without any request, e.g. after fixing a selector.",
+    )
+    parser.add_argument(
+        "--reextract-workers",
+        dest="reextract_workers",
+        type=int,
+        default=0,
+        required=False,
+        help="Number of processes parsing cached pages in --reextract. Default is 0 which means the number of cores.",
+    )
+    return parser
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    """
+    Parses and validates the crawler arguments, resolving --list-first and --sites.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    list_fields = [field.strip() for field in args.list_fields.split(",") if field.strip() != ""]
+    for field in list_fields:
+        if field == "name" or field not in new_info():
+            parser.error(f"unknown field in --list-first: {field}")
+
+    known_sites = load_sites(args.site_file) if args.site_file != "" else SITES
+    site_names = [name.strip() for name in args.sites.split(",") if name.strip() != ""]
+    for name in site_names:
+        if name not in known_sites:
+            parser.error(f"unknown site: {name}")
 
-    work(start=args.start, count=args.count)
+    if args.store != "" and args.sink != "":
+        parser.error("--store and --sink are exclusive")
+    if args.reextract and args.cache_dir == "":
+        parser.error("--reextract needs --cache-dir")
+    if args.reextract and args.refresh:
+        parser.error("--reextract and --refresh are exclusive")
+    if args.pipeline and (args.refresh or args.queue != "" or args.retry_failed):
+        parser.error("--pipeline does not work with --refresh, --queue or --retry-failed")
+
+    args.site_dirs = len(site_names) > 0
+    if len(site_names) == 0:
+        site_names = [DEFAULT_SITE]
+    args.list_fields = list_fields
+    args.sites = [known_sites[name] for name in site_names]
+    return args
+
+
+def main():
+    work(parse_args())
     input("Press ENTER to exit.")
 
 
@@ -21,13 +21,78 @@ webSocket.onmessage = function (message) {
     onWebSocketMessage(message);
 };
 
+function reply(command, result) {
+    // the id tells the python side which of its pending commands this result belongs to
+    webSocket.send(JSON.stringify({ id: command.id, result: result }));
+}
+
 function onWebSocketMessage(message) {
     printLog(message.data);
     var command = JSON.parse(message.data);
+    // the python side gives up on the command after its timeout, so stop retrying it then
+    command.deadline = Date.now() + command.timeout * 1000;
+    runCommand(command);
+}
+
+function retryCommand(command) {
+    if (Date.now() < command.deadline) {
+        setTimeout(runCommand, 100, command);
+    }
+}
+
+function withTab(command, callback) {
+    // commands without a tab id go to the active tab
+    if (command.tabId != undefined) {
+        callback(command.tabId);
+        return;
+    }
+    chrome.tabs.query({ active: true, currentWindow: true }, function (tabs) {
+        if (tabs == undefined) {
+            retryCommand(command);
+        }
+        else if (tabs[0] == undefined) {
+            retryCommand(command);
+        }
+        else {
+            callback(tabs[0].id);
+        }
+    });
+}
+
+function navigate(command, tabId) {
+    // the load started by this command, not one still running before it, has to complete
+    var loading = false;
+    var timer = null;
+    var listener = function (updatedTabId, changeInfo, tab) {
+        if (updatedTabId !== tabId) {
+            return;
+        }
+        if (changeInfo.status === "loading") {
+            loading = true;
+        } else if (changeInfo.status === "complete" && loading) {
+            chrome.tabs.onUpdated.removeListener(listener);
+            clearTimeout(timer);
+            reply(command, tab.url);
+        }
+    };
+    chrome.tabs.onUpdated.addListener(listener);
+    timer = setTimeout(function () {
+        chrome.tabs.onUpdated.removeListener(listener);
+    }, command.deadline - Date.now());
+
+    chrome.tabs.get(tabId, function (tab) {
+        if (tab.url === command.payload) {
+            chrome.tabs.reload(tabId);
+        } else {
+            chrome.tabs.update(tabId, { url: command.payload });
+        }
+    });
+}
+
+function runCommand(command) {
     if (command.msg === "clearCookie") {
         var callback = function () {
-            resStr = JSON.stringify({ result: "" });
-            webSocket.send(resStr);
+            reply(command, "");
         };
         var millisecondsPerWeek = 1000 * 60 * 60 * 24 * 7;
         var oneWeekAgo = (new Date()).getTime() - millisecondsPerWeek;
@@ -50,29 +115,43 @@ function onWebSocketMessage(message) {
         }, callback);
     } else if (command.msg === "getCookie") {
         chrome.cookies.getAll({ domain: command.payload }, function (cookies) {
-            resStr = JSON.stringify({ result: cookies });
-            webSocket.send(resStr);
+            reply(command, cookies);
+        });
+    } else if (command.msg === "openTab") {
+        chrome.tabs.create({ url: command.payload, active: false }, function (tab) {
+            reply(command, tab.id);
+        });
+    } else if (command.msg === "closeTab") {
+        chrome.tabs.remove(command.tabId, function () {
+            reply(command, "");
+        });
+    } else if (command.msg === "navigate") {
+        withTab(command, function (tabId) {
+            navigate(command, tabId);
+        });
+    } else if (command.msg === "waitSelector") {
+        withTab(command, function (tabId) {
+            var timeout = (command.deadline - Date.now()) / 1000;
+            chrome.tabs.sendMessage(tabId, { waitSelector: command.payload, timeout: timeout }, function (response) {
+                if (response == undefined) {
+                    // no content script yet, or the page navigated away while waiting
+                    retryCommand(command);
+                } else {
+                    reply(command, response.result);
+                }
+            });
         });
     } else if (command.msg === "runScript") {
-        chrome.tabs.query({ active: true, currentWindow: true }, function (tabs) {
-            if (tabs == undefined) {
-                setTimeout(onWebSocketMessage, 100, message);
-            }
-            else if (tabs[0] == undefined) {
-                setTimeout(onWebSocketMessage, 100, message);
-            }
-            else {
-                chrome.tabs.sendMessage(tabs[0].id, { script: command.payload }, function (response) {
-                    if (response == undefined) {
-                        setTimeout(onWebSocketMessage, 100, message);
-                    } else if (response.result == undefined) {
-                        setTimeout(onWebSocketMessage, 100, message);
-                    } else {
-                        resStr = JSON.stringify({ result: response.result });
-                        webSocket.send(resStr);
-                    }
-                });
-            }
+        withTab(command, function (tabId) {
+            chrome.tabs.sendMessage(tabId, { script: command.payload }, function (response) {
+                if (response == undefined) {
+                    retryCommand(command);
+                } else if (response.result == undefined) {
+                    retryCommand(command);
+                } else {
+                    reply(command, response.result);
+                }
+            });
         });
     }
 }
@@ -4,12 +4,40 @@ function printLog(logStr) {
 
 printLog("loaded");
 
+function waitSelector(selector, timeout, sendResponse) {
+    if (document.querySelector(selector) != null) {
+        sendResponse({ result: true });
+        return;
+    }
+
+    // checked on every change of the document instead of polling
+    var timer = null;
+    var observer = new MutationObserver(function () {
+        if (document.querySelector(selector) != null) {
+            observer.disconnect();
+            clearTimeout(timer);
+            sendResponse({ result: true });
+        }
+    });
+    observer.observe(document, { childList: true, subtree: true });
+    timer = setTimeout(function () {
+        observer.disconnect();
+        sendResponse({ result: false });
+    }, timeout * 1000);
+}
+
 chrome.runtime.onMessage.addListener(
     function (request, sender, sendResponse) {
         printLog(sender.tab ?
             "from a content script:" + sender.tab.url :
             "from the extension");
 
+        if (request.waitSelector != undefined) {
+            waitSelector(request.waitSelector, request.timeout, sendResponse);
+            // sendResponse is called later
+            return true;
+        }
+
         jscript = request.script;
         printLog("script > " + jscript)
 
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+import traceback
+import zlib
+from typing import Optional
+
+from liblogger import log_inf
+
+CACHE_EXT = ".html.z"
+
+
+class HtmlCache:
+    """
+    Compressed raw responses on disk, keyed by the sha256 of their url.
+    Once the cache grows beyond `max_bytes`, the least recently used responses are evicted
+    until it is back under `low_ratio` of the limit.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 << 30, low_ratio: float = 0.9):
+        self.__cache_dir = cache_dir
+        self.__max_bytes = max_bytes
+        self.__low_ratio = low_ratio
+        self.__lock = threading.Lock()
+        self.__size = 0
+        self.__counted = False
+
+    def __fpath(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.__cache_dir, key[:2], key + CACHE_EXT)
+
+    def __entries(self) -> list[os.DirEntry]:
+        ret = []
+        if os.path.isdir(self.__cache_dir):
+            for sub_entry in os.scandir(self.__cache_dir):
+                if sub_entry.is_dir():
+                    ret.extend([entry for entry in os.scandir(sub_entry.path) if entry.name.endswith(CACHE_EXT)])
+        return ret
+
+    def __count(self):
+        # the size is only counted once per process, on the first write
+        if not self.__counted:
+            self.__size = sum([entry.stat().st_size for entry in self.__entries()])
+            self.__counted = True
+            log_inf(f"cache: {self.__size / (1 << 20):.1f} MB in {self.__cache_dir}")
+
+    def __evict(self):
+        entries = sorted(self.__entries(), key=lambda entry: entry.stat().st_mtime)
+        evict_count = 0
+        for entry in entries:
+            if self.__size <= self.__max_bytes * self.__low_ratio:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.__size -= size
+                evict_count += 1
+            except FileNotFoundError:
+                pass
+        log_inf(f"cache: evicted {evict_count} responses, {self.__size / (1 << 20):.1f} MB left")
+
+    def get(self, url: str) -> Optional[str]:
+        fpath = self.__fpath(url)
+        try:
+            with open(fpath, "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+            # mtime is the recency for eviction
+            os.utime(fpath)
+            return text
+        except FileNotFoundError:
+            pass
+        except:
+            traceback.print_exc()
+        return None
+
+    def put(self, url: str, text: str):
+        fpath = self.__fpath(url)
+        try:
+            data = zlib.compress(text.encode("utf-8"), 6)
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            tmp_fpath = f"{fpath}.{threading.get_ident()}.tmp"
+            with open(tmp_fpath, "wb") as f:
+                f.write(data)
+
+            with self.__lock:
+                self.__count()
+                old_size = os.path.getsize(fpath) if os.path.isfile(fpath) else 0
+                os.replace(tmp_fpath, fpath)
+                self.__size += len(data) - old_size
+                if self.__size > self.__max_bytes:
+                    self.__evict()
+        except:
+            traceback.print_exc()
@@ -3,8 +3,10 @@ import os
 import shutil
 import socket
 import subprocess
+import threading
 import time
 import traceback
+from concurrent.futures import Future, TimeoutError
 from datetime import datetime
 from pathlib import Path
 from random import randint
@@ -14,11 +16,13 @@ import userpaths
 from colorama import init
 
 from liblogger import log_err, log_inf
-from libwebsocket import WebSocketServer
+from libwebsocket import WebSocketClientUnit, WebSocketServer
 
 CUR_DIR = str(Path(__file__).parent.absolute())
 TEMP_DIR = os.path.join(CUR_DIR, "temp")
 EXTENSION_DIR = os.path.join(CUR_DIR, "ext")
+COMMAND_TIMEOUT = 30.0
+EXPIRE_INTERVAL = 1.0
 
 
 class ChromeElem:
@@ -34,51 +38,110 @@ class Chrome:
         height: int = 0,
         block_image: bool = False,
         user_data_dir: Optional[str] = None,
+        deflate: bool = False,
     ):
         self.__init_url = init_url
         self.__width = width
         self.__height = height
         self.__block_image = block_image
         self.__user_data_dir = user_data_dir
+        self.__deflate = deflate
         self.__process = None
         self.__client_unit = None
+        # commands sent and waiting for their reply, by id, with their deadline
+        self.__lock = threading.Lock()
+        self.__next_id = 0
+        self.__pending: dict[int, tuple[Future, float]] = {}
+        self.__reader: Optional[threading.Thread] = None
+        self.__sweeper: Optional[threading.Thread] = None
 
     def __find_port(self) -> int:
         with socket.socket() as s:
             s.bind(("", 0))  # Bind to a free port provided by the host
             return s.getsockname()[1]  # Return the assigned port number
 
-    def __send_command(self, msg: str, payload: Optional[str] = None) -> Any:
+    def __read_replies(self, client_unit: WebSocketClientUnit):
+        """
+        Hands every reply of the extension to the command with its id, in whatever order they come.
+        """
+        while True:
+            resp = client_unit.recv()
+            if resp == None:
+                break
+            try:
+                jresp = json.loads(resp)
+                with self.__lock:
+                    future, _ = self.__pending.pop(jresp["id"], (None, 0.0))
+                # no future if the command timed out already
+                if future != None:
+                    js_res = jresp["result"]
+                    future.set_result(js_res if js_res != "<undefined>" else None)
+            except:
+                traceback.print_exc()
+
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            self.__reader = None
+        for future, _ in pending.values():
+            future.set_exception(ConnectionError("extension disconnected"))
+
+    def __expire(self):
+        """
+        Fails the commands past their deadline, their late replies are dropped.
+        """
+        now = time.time()
+        with self.__lock:
+            expired = [command_id for command_id, (_, deadline) in self.__pending.items() if deadline < now]
+            futures = [self.__pending.pop(command_id)[0] for command_id in expired]
+        for future in futures:
+            future.set_exception(TimeoutError("command timeout"))
+
+    def __sweep_expired(self, reader: threading.Thread):
+        """
+        Expires the pending commands every EXPIRE_INTERVAL while `reader` is connected,
+        so a future times out even if no further command is submitted.
+        """
+        while reader.is_alive():
+            time.sleep(EXPIRE_INTERVAL)
+            self.__expire()
+
+    def submit_command(self, msg: str, payload: Optional[str] = None, timeout: float = COMMAND_TIMEOUT, tab_id: Optional[int] = None) -> Future:
+        """
+        Sends a command without waiting for its reply, so several commands can be in flight at once.
+        The future resolves to the result of the command. Scripts run in the active tab unless `tab_id` is given.
+        """
+        self.__expire()
+        future = Future()
+        with self.__lock:
+            client_unit = self.__client_unit if self.__reader != None else None
+            if client_unit != None:
+                self.__next_id += 1
+                command_id = self.__next_id
+                self.__pending[command_id] = (future, time.time() + timeout)
+        if client_unit == None:
+            future.set_exception(ConnectionError("client_unit is none"))
+            return future
+
+        command = {"id": command_id, "msg": msg, "timeout": timeout}
+        if payload != None:
+            command["payload"] = payload
+        if tab_id != None:
+            command["tabId"] = tab_id
+        if not client_unit.send(json.dumps(command)):
+            with self.__lock:
+                self.__pending.pop(command_id, None)
+            future.set_exception(ConnectionError("failed send command"))
+        return future
+
+    def __send_command(self, msg: str, payload: Optional[str] = None, timeout: float = COMMAND_TIMEOUT, tab_id: Optional[int] = None) -> Any:
         ret = None
         try:
-            if self.__client_unit != None:
-                if payload != None:
-                    self.__client_unit.send(
-                        json.dumps(
-                            {
-                                "msg": msg,
-                                "payload": payload,
-                            }
-                        )
-                    )
-                else:
-                    self.__client_unit.send(
-                        json.dumps(
-                            {
-                                "msg": msg,
-                            }
-                        )
-                    )
-                resp = self.__client_unit.recv()
-                if resp != None:
-                    js_res = json.loads(resp)["result"]
-                    if js_res != "<undefined>":
-                        ret = js_res
-                else:
-                    log_err("resp is none")
-                    time.sleep(0.5)
-            else:
-                log_err("client_unit is none")
+            ret = self.submit_command(msg, payload, timeout=timeout, tab_id=tab_id).result(timeout)
+        except TimeoutError:
+            log_err(f"{msg} timeout")
+        except ConnectionError as e:
+            log_err(f"{msg} failed: {e}")
+            time.sleep(0.5)
         except:
             traceback.print_exc()
         return ret
@@ -100,7 +163,7 @@ class Chrome:
             port = self.__find_port()
 
             # start socket server
-            websocket_server = WebSocketServer("127.0.0.1", port)
+            websocket_server = WebSocketServer("127.0.0.1", port, deflate=self.__deflate)
             websocket_server.start()
 
             # copy extension to temp folder
@@ -141,49 +204,51 @@ class Chrome:
             # accept
             self.__client_unit = websocket_server.accept()
             log_inf("client connected")
+            if self.__client_unit != None:
+                self.__reader = threading.Thread(target=self.__read_replies, args=(self.__client_unit,), daemon=True)
+                self.__reader.start()
+                self.__sweeper = threading.Thread(target=self.__sweep_expired, args=(self.__reader,), daemon=True)
+                self.__sweeper.start()
         else:
             log_err("chrome.exe not found")
 
-    def run_script(self, script: str) -> Optional[str]:
-        return self.__send_command("runScript", script)
+    def run_script(self, script: str, timeout: float = COMMAND_TIMEOUT, tab_id: Optional[int] = None) -> Optional[str]:
+        return self.__send_command("runScript", script, timeout=timeout, tab_id=tab_id)
+
+    def run_script_async(self, script: str, timeout: float = COMMAND_TIMEOUT, tab_id: Optional[int] = None) -> Future:
+        return self.submit_command("runScript", script, timeout=timeout, tab_id=tab_id)
 
-    def url(self) -> Optional[str]:
-        return self.run_script("location.href")
+    def open_tab(self, url: Optional[str] = None) -> Optional[int]:
+        """
+        Opens a background tab on `url`, the start page by default, and returns its id.
+        """
+        return self.__send_command("openTab", url if url != None else self.__init_url)
 
-    def goto(self, url2go: str, wait_timeout: float = 30.0, wait_elem_selector: Optional[str] = None) -> bool:
+    def close_tab(self, tab_id: int):
+        return self.__send_command("closeTab", tab_id=tab_id)
+
+    def url(self, tab_id: Optional[int] = None) -> Optional[str]:
+        return self.run_script("location.href", tab_id=tab_id)
+
+    def goto(self, url2go: str, wait_timeout: float = 30.0, wait_elem_selector: Optional[str] = None, tab_id: Optional[int] = None) -> bool:
+        """
+        Loads `url2go` and waits until the tab finished loading and `wait_elem_selector` matches.
+        The extension replies as soon as that happens, nothing is polled meanwhile.
+        """
         ret = False
         try:
-            timeout = False
-
-            old_url = self.url()
-            if old_url == url2go:
-                self.run_script("location.reload()")
-            else:
-                self.run_script(f"location.href='{url2go}'")
-                # wait for url changed
-                start_tstamp = datetime.now().timestamp()
-                while True:
-                    if old_url != self.url():
-                        break
-                    if datetime.now().timestamp() - start_tstamp > wait_timeout:
+            deadline = time.time() + wait_timeout
+            # replied with the url of the tab once it finished loading
+            if self.__send_command("navigate", url2go, timeout=wait_timeout, tab_id=tab_id) != None:
+                if wait_elem_selector == None:
+                    ret = True
+                else:
+                    # replied once the selector matches, False if it did not before the timeout
+                    wait_time = max(deadline - time.time(), 0.0)
+                    found = self.__send_command("waitSelector", wait_elem_selector, timeout=wait_time, tab_id=tab_id)
+                    if found == False:
                         log_err("timeout")
-                        timeout = True
-                        break
-
-            # wait for element valid
-            if not timeout:
-                if wait_elem_selector != None:
-                    start_tstamp = datetime.now().timestamp()
-                    while True:
-                        wait_elem = self.select_one(wait_elem_selector)
-                        if wait_elem != None:
-                            break
-                        if datetime.now().timestamp() - start_tstamp > wait_timeout:
-                            log_err("timeout")
-                            timeout = True
-                            break
-            if not timeout:
-                ret = True
+                    ret = found == True
         except:
             traceback.print_exc()
         return ret
@@ -202,7 +267,7 @@ class Chrome:
     def body(self) -> Optional[str]:
         self.run_script("document.body")
 
-    def select(self, selector: str) -> list[ChromeElem]:
+    def select(self, selector: str, tab_id: Optional[int] = None) -> list[ChromeElem]:
         ret = []
         jres = self.run_script(
             """
@@ -235,15 +300,16 @@ for (var elem in elemList) {
     }
 }
 
-selectors;"""
+selectors;""",
+            tab_id=tab_id,
         )
         if jres != None:
             for jitem in jres:
                 ret.append(ChromeElem(jitem))
         return ret
 
-    def select_one(self, selector: str) -> Optional[ChromeElem]:
-        elems = self.select(selector=selector)
+    def select_one(self, selector: str, tab_id: Optional[int] = None) -> Optional[ChromeElem]:
+        elems = self.select(selector=selector, tab_id=tab_id)
         if len(elems) > 0:
             return elems[0]
         else:
@@ -263,6 +329,68 @@ selectors;"""
         self.__block_image = True
 
 
+class TabPool:
+    """
+    Tabs of one Chrome, each leased to one worker at a time, so several workers share a browser process.
+    Tabs are opened on demand up to `size`. They share the profile and so the cookies of the browser.
+    """
+
+    def __init__(self, chrome: Chrome, size: int = 4):
+        self.__chrome = chrome
+        self.__size = max(size, 1)
+        self.__cond = threading.Condition()
+        self.__idle: list[int] = []
+        self.__tab_count = 0
+
+    def lease(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Returns the id of an idle tab, waiting for one if all `size` tabs are leased.
+        Returns None on timeout or if no tab could be opened.
+        """
+        deadline = time.time() + timeout if timeout != None else None
+        with self.__cond:
+            while len(self.__idle) == 0 and self.__tab_count >= self.__size:
+                wait_time = deadline - time.time() if deadline != None else None
+                if wait_time != None and wait_time <= 0:
+                    return None
+                self.__cond.wait(wait_time)
+            if len(self.__idle) > 0:
+                return self.__idle.pop()
+            self.__tab_count += 1
+
+        tab_id = self.__chrome.open_tab()
+        if tab_id == None:
+            log_err("failed open tab")
+            with self.__cond:
+                self.__tab_count -= 1
+                self.__cond.notify()
+        return tab_id
+
+    def release(self, tab_id: int):
+        with self.__cond:
+            self.__idle.append(tab_id)
+            self.__cond.notify()
+
+    def discard(self, tab_id: int):
+        """
+        Closes a leased tab that is no longer usable, a later lease opens a new one.
+        """
+        self.__chrome.close_tab(tab_id)
+        with self.__cond:
+            self.__tab_count -= 1
+            self.__cond.notify()
+
+    def close(self):
+        """
+        Closes the idle tabs.
+        """
+        with self.__cond:
+            idle, self.__idle = self.__idle, []
+            self.__tab_count -= len(idle)
+        for tab_id in idle:
+            self.__chrome.close_tab(tab_id)
+
+
 if __name__ == "__main__":
     chrome = Chrome(init_url="https://google.com")
     chrome.start()
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Optional
+
+from liblogger import log_err, log_inf
+
+CLEARANCE_COOKIE_NAME = "cf_clearance"
+
+
+class CookieIdentity:
+    def __init__(self, cookies: list[dict[str, Any]], user_agent: str, expires: float = 0.0, tstamp: float = 0.0):
+        self.cookies = cookies
+        self.user_agent = user_agent
+        self.expires = expires
+        self.tstamp = tstamp if tstamp != 0.0 else time.time()
+
+    def header(self) -> str:
+        return "; ".join([f"{cookie['name']}={cookie['value']}" for cookie in self.cookies])
+
+    def cookie_dict(self) -> dict[str, str]:
+        return {cookie["name"]: cookie["value"] for cookie in self.cookies}
+
+    def is_expired(self) -> bool:
+        return self.expires <= time.time()
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "cookies": self.cookies,
+            "user_agent": self.user_agent,
+            "expires": self.expires,
+            "tstamp": self.tstamp,
+        }
+
+    @staticmethod
+    def from_json(jobj: dict[str, Any]) -> "CookieIdentity":
+        return CookieIdentity(
+            cookies=jobj["cookies"],
+            user_agent=jobj["user_agent"],
+            expires=jobj["expires"],
+            tstamp=jobj.get("tstamp", 0.0),
+        )
+
+
+def get_expires(cookies: list[dict[str, Any]], ttl: float) -> float:
+    expires = time.time() + ttl
+    for cookie in cookies:
+        if cookie.get("name") == CLEARANCE_COOKIE_NAME and "expirationDate" in cookie:
+            expires = min(expires, float(cookie["expirationDate"]))
+    return expires
+
+
+class CookieProvider:
+    """
+    Hands out the current cookie + user agent of one cookie domain.
+    Concurrent refresh requests are coalesced into a single call of `solve`, and the
+    last good identity is kept on disk so a restart can reuse it until it expires.
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        solve: Callable[[], Optional[CookieIdentity]],
+        cache_dir: str,
+        ttl: float = 3600.0,
+        on_change: Optional[Callable[[CookieIdentity], None]] = None,
+    ):
+        self.__domain = domain
+        self.__solve = solve
+        self.__cache_fpath = os.path.join(cache_dir, f"{domain.strip('.')}.json")
+        self.__ttl = ttl
+        self.__on_change = on_change
+        self.__lock = threading.Lock()
+        self.__identity: Optional[CookieIdentity] = None
+
+    def __set(self, identity: CookieIdentity):
+        self.__identity = identity
+        if self.__on_change != None:
+            self.__on_change(identity)
+
+    def load(self) -> Optional[CookieIdentity]:
+        try:
+            if os.path.isfile(self.__cache_fpath):
+                with open(self.__cache_fpath, "r") as f:
+                    identity = CookieIdentity.from_json(json.load(f))
+                if identity.is_expired():
+                    log_inf(f"cached cookie of {self.__domain} is expired")
+                else:
+                    log_inf(f"reuse cached cookie of {self.__domain} > {identity.header()}")
+                    with self.__lock:
+                        self.__set(identity)
+        except:
+            traceback.print_exc()
+        return self.__identity
+
+    def save(self):
+        try:
+            if self.__identity != None:
+                os.makedirs(os.path.dirname(self.__cache_fpath), exist_ok=True)
+                tmp_fpath = self.__cache_fpath + ".tmp"
+                with open(tmp_fpath, "w") as f:
+                    json.dump(self.__identity.to_json(), f, indent=2)
+                os.replace(tmp_fpath, self.__cache_fpath)
+        except:
+            traceback.print_exc()
+
+    def current(self) -> Optional[CookieIdentity]:
+        identity = self.__identity
+        if identity != None and identity.is_expired():
+            identity = self.refresh(identity)
+        return identity
+
+    def refresh(self, stale: Optional[CookieIdentity]) -> Optional[CookieIdentity]:
+        """
+        Replaces `stale` by a freshly solved identity.
+        Callers that report the same stale identity while a refresh is running wait for it and share its result.
+        """
+        with self.__lock:
+            if self.__identity != None and self.__identity is not stale:
+                return self.__identity
+
+            log_inf(f"fetch new cookie of {self.__domain}")
+            identity = self.__solve()
+            if identity != None:
+                identity.expires = get_expires(identity.cookies, self.__ttl)
+                self.__set(identity)
+                self.save()
+                log_inf(f"cookie > {identity.header()}")
+            else:
+                log_err(f"failed to solve cookie of {self.__domain}")
+            return self.__identity
@@ -0,0 +1,69 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Optional
+
+UMLAUTS = {"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"}
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Lower case ascii words of `text`, so spelling variants of one name or address compare equal.
+    """
+    text = text.lower()
+    for umlaut, replacement in UMLAUTS.items():
+        text = text.replace(umlaut, replacement)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return NON_WORD_RE.sub(" ", text).strip()
+
+
+def dedup_keys(link: str, name: str, address: str) -> list[str]:
+    """
+    Keys of one company: its detail link, and its name with address if the list page shows both.
+    The link only matches within a chamber, name and address also match across chambers.
+    """
+    keys = [f"link:{link}"]
+    name, address = normalize(name), normalize(address)
+    # the "#" placeholder of a missing address normalizes to ""
+    if name != "" and address != "":
+        keys.append(f"name:{name}|{address}")
+    return keys
+
+
+class DedupIndex:
+    """
+    Records of the companies fetched so far, shared by all runs and sites writing to one output folder.
+    """
+
+    def __init__(self, fpath: str):
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+        self.__conn = sqlite3.connect(fpath, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, info TEXT NOT NULL, tstamp REAL NOT NULL)")
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+    def get(self, keys: list[str]) -> Optional[dict[str, Any]]:
+        with self.__lock:
+            for key in keys:
+                row = self.__conn.execute("SELECT info FROM records WHERE key = ?", (key,)).fetchone()
+                if row != None:
+                    return json.loads(row[0])
+        return None
+
+    def put(self, keys: list[str], info: dict[str, Any]):
+        now = time.time()
+        data = json.dumps(info)
+        with self.__lock:
+            self.__conn.execute("BEGIN")
+            self.__conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?)", [(key, data, now) for key in keys])
+            self.__conn.execute("COMMIT")
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+from libcookie import CookieIdentity, get_expires
+from liblogger import log_err, log_inf
+
+
+class IdentityPool:
+    """
+    Keeps `size` cookie + user agent identities of one cookie domain warm.
+    A background harvester solves a new identity whenever one is missing, was reported as
+    challenged, or gets close to its observed lifetime. Workers take identities round-robin,
+    so an identity expiring only blocks the requests that used it.
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        solve: Callable[[], Optional[CookieIdentity]],
+        cache_dir: str,
+        size: int = 3,
+        ttl: float = 3600.0,
+        refresh_ratio: float = 0.8,
+    ):
+        self.__domain = domain
+        self.__solve = solve
+        self.__cache_fpath = os.path.join(cache_dir, f"{domain.strip('.')}.pool.json")
+        self.__size = max(size, 1)
+        self.__ttl = ttl
+        self.__refresh_ratio = refresh_ratio
+        self.__lifetime = ttl
+        self.__cond = threading.Condition()
+        self.__identities: list[Optional[CookieIdentity]] = [None] * self.__size
+        self.__cursor = 0
+        self.__running = False
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def lifetime(self) -> float:
+        return self.__lifetime
+
+    def __due_tstamp(self, identity: Optional[CookieIdentity]) -> float:
+        if identity == None:
+            return 0.0
+        return min(identity.expires, identity.tstamp + self.__lifetime * self.__refresh_ratio)
+
+    def __next_slot(self) -> tuple[Optional[int], float]:
+        """
+        Returns the slot to harvest next, or None and the seconds until the next one is due.
+        """
+        now = time.time()
+        due_list = [self.__due_tstamp(identity) for identity in self.__identities]
+        slot = min(range(self.__size), key=lambda i: due_list[i])
+        if due_list[slot] <= now:
+            return slot, 0.0
+        return None, due_list[slot] - now
+
+    def __harvest(self):
+        while self.__running:
+            with self.__cond:
+                slot, wait_time = self.__next_slot()
+                if slot == None:
+                    self.__cond.wait(timeout=wait_time)
+                    continue
+
+            identity = None
+            try:
+                log_inf(f"harvest identity {slot} of {self.__domain}")
+                identity = self.__solve()
+            except:
+                traceback.print_exc()
+
+            if identity == None:
+                log_err(f"failed to harvest identity {slot} of {self.__domain}")
+                time.sleep(5.0)
+                continue
+
+            identity.tstamp = time.time()
+            identity.expires = get_expires(identity.cookies, self.__ttl)
+            with self.__cond:
+                self.__identities[slot] = identity
+                self.__cond.notify_all()
+            self.save()
+            log_inf(f"identity {slot} > {identity.header()}")
+
+    def load(self):
+        try:
+            if os.path.isfile(self.__cache_fpath):
+                with open(self.__cache_fpath, "r") as f:
+                    jobj = json.load(f)
+                with self.__cond:
+                    self.__lifetime = jobj.get("lifetime", self.__ttl)
+                    identities = [CookieIdentity.from_json(jitem) for jitem in jobj["identities"]]
+                    identities = [identity for identity in identities if not identity.is_expired()]
+                    for i, identity in enumerate(identities[: self.__size]):
+                        self.__identities[i] = identity
+                log_inf(f"reuse {len(identities)} cached identities of {self.__domain}")
+        except:
+            traceback.print_exc()
+
+    def save(self):
+        try:
+            with self.__cond:
+                jobj = {
+                    "lifetime": self.__lifetime,
+                    "identities": [identity.to_json() for identity in self.__identities if identity != None],
+                }
+            os.makedirs(os.path.dirname(self.__cache_fpath), exist_ok=True)
+            tmp_fpath = self.__cache_fpath + ".tmp"
+            with open(tmp_fpath, "w") as f:
+                json.dump(jobj, f, indent=2)
+            os.replace(tmp_fpath, self.__cache_fpath)
+        except:
+            traceback.print_exc()
+
+    def start(self):
+        if self.__thread == None:
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__harvest, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify_all()
+        self.__thread = None
+
+    def current(self) -> CookieIdentity:
+        """
+        Returns the next live identity in round-robin order, waiting for the harvester if none is live.
+        """
+        with self.__cond:
+            while True:
+                for _ in range(self.__size):
+                    identity = self.__identities[self.__cursor]
+                    self.__cursor = (self.__cursor + 1) % self.__size
+                    if identity != None and not identity.is_expired():
+                        return identity
+                self.__cond.notify_all()
+                self.__cond.wait()
+
+    def refresh(self, stale: Optional[CookieIdentity]) -> CookieIdentity:
+        """
+        Retires `stale` after it got challenged and returns another live identity.
+        """
+        with self.__cond:
+            if stale != None and stale in self.__identities:
+                # a challenged identity tells how long identities actually survive
+                observed = time.time() - stale.tstamp
+                self.__lifetime = max(60.0, 0.7 * self.__lifetime + 0.3 * observed)
+                self.__identities[self.__identities.index(stale)] = None
+                log_inf(f"retire identity of {self.__domain} after {observed:.0f}s, lifetime > {self.__lifetime:.0f}s")
+                self.__cond.notify_all()
+        return self.current()
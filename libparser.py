@@ -0,0 +1,462 @@
+import html
+import re
+import sys
+import threading
+import traceback
+from typing import Any, Callable, Optional, Union
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from liblogger import log_dbg, log_err, log_inf
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+HIT_SELECTOR = ".searchhit-result"
+CARD_SELECTOR = ".container.content>div.row:nth-child(2)>div.col-md-3"
+
+PARSER_NAMES = ["html.parser", "lxml", "lxml-tree"]
+
+
+def has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def match_class(name: str) -> Callable[[Any], bool]:
+    # the strainer sees the raw attribute string while parsing, not the split class list
+    def match(value: Any) -> bool:
+        if value == None:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return name in value
+
+    return match
+
+
+# restricted-subtree parse: only the hit blocks of a list page and the content container of a detail page are built
+HIT_STRAINER = SoupStrainer(class_=match_class("searchhit-result"))
+CARD_STRAINER = SoupStrainer(class_=match_class("content"))
+
+
+def new_info() -> dict[str, str]:
+    return {
+        "name": "#",
+        "address": "#",
+        "email": "#",
+        "telephone": "#",
+        "mobile": "#",
+        "fax": "#",
+    }
+
+
+def parse_address(words: list[str], info: dict[str, str]):
+    street = words[1].strip()
+    zip = words[2].split(" ", 1)[0].strip()
+    city = words[2].split(" ", 1)[1].strip()
+    address = f"{city} {street}"
+    info["address"] = address
+
+
+def parse_contact(words: list[str], info: dict[str, str]):
+    for word in words:
+        word = word.lower().strip()
+        if word.startswith("telefon"):
+            info["telephone"] = word.replace("telefon", "").strip()
+        elif word.startswith("handy"):
+            info["mobile"] = word.replace("handy", "").strip()
+        elif word.startswith("fax"):
+            info["fax"] = word.replace("fax", "").strip()
+
+
+class SoupParser:
+    """
+    Reference extractor on BeautifulSoup. `features` picks the tree builder, `strain` parses only the needed subtree.
+    """
+
+    def __init__(
+        self,
+        features: str = "html.parser",
+        strain: bool = False,
+        hit_selector: str = HIT_SELECTOR,
+        card_selector: str = CARD_SELECTOR,
+    ):
+        self.__features = features
+        self.__strain = strain
+        self.__hit_selector = hit_selector
+        self.__card_selector = card_selector
+
+    def __soup(self, text: str, strainer: SoupStrainer) -> BeautifulSoup:
+        if self.__strain:
+            return BeautifulSoup(text, self.__features, parse_only=strainer)
+        return BeautifulSoup(text, self.__features)
+
+    def parse_list(self, text: str) -> list[dict[str, Any]]:
+        hits = []
+        soup = self.__soup(text, HIT_STRAINER)
+        for result_elem in soup.select(self.__hit_selector):
+            hit: dict[str, Any] = {"link": None, "name": "#"}
+            link_elem = result_elem.select_one("a")
+            if link_elem != None:
+                hit["link"] = link_elem.attrs["href"]
+                hit["name"] = link_elem.text.strip()
+            hit["info"] = parse_hit(result_elem.decode_contents(), hit["name"])
+            hits.append(hit)
+        return hits
+
+    def parse_detail(self, text: str, info: dict[str, str]):
+        soup = self.__soup(text, CARD_STRAINER)
+        cards = soup.select(self.__card_selector)
+
+        # address
+        p_elem = cards[0].select_one("p")
+        if p_elem != None:
+            parse_address(p_elem.decode_contents().split("<br/>"), info)
+        else:
+            log_err("p_elem is none")
+
+        if len(cards) > 1:
+            p_elem = cards[1].select_one("p")
+            if p_elem != None:
+                # email
+                email_elem = p_elem.select_one("a.mail")
+                if email_elem != None:
+                    email = email_elem.text.strip()
+                    info["email"] = email.replace("--at--", "@")
+                else:
+                    log_err("email elem is none")
+
+                # phone
+                parse_contact(p_elem.decode_contents().split("<br/>"), info)
+            else:
+                log_err("p_elem is none")
+        else:
+            log_err("no contact")
+
+
+class LxmlParser:
+    """
+    Extractor on a plain lxml tree with precompiled XPath, without building a BeautifulSoup tree.
+    """
+
+    def __init__(self, hit_selector: str = HIT_SELECTOR, card_selector: str = CARD_SELECTOR):
+        if lxml_html == None:
+            raise ImportError("lxml is not installed")
+        self.__hits_xpath = f"//*[{has_class('searchhit-result')}]"
+        self.__cards_xpath = (
+            f"//*[{has_class('container')} and {has_class('content')}]"
+            + f"/*[2][self::div and {has_class('row')}]"
+            + f"/div[{has_class('col-md-3')}]"
+        )
+
+        # other selectors than the default layout need cssselect to be translated
+        if hit_selector != HIT_SELECTOR:
+            self.__hits_xpath = css_to_xpath(hit_selector)
+        if card_selector != CARD_SELECTOR:
+            self.__cards_xpath = css_to_xpath(card_selector)
+        self.__mail_xpath = f".//a[{has_class('mail')}]"
+
+    def __lines(self, elem: Any) -> list[str]:
+        """
+        Splits the contents of `elem` at <br> like `decode_contents().split("<br/>")` does on the soup tree.
+        """
+        lines = [""]
+        if elem.text != None:
+            lines[-1] += html.escape(elem.text, quote=False)
+        for child in elem:
+            if child.tag == "br":
+                lines.append("")
+            elif isinstance(child.tag, str):
+                lines[-1] += lxml_html.tostring(child, encoding="unicode", with_tail=False)
+            if child.tail != None:
+                lines[-1] += html.escape(child.tail, quote=False)
+        return lines
+
+    def parse_list(self, text: str) -> list[dict[str, Any]]:
+        hits = []
+        tree = lxml_html.fromstring(text)
+        for result_elem in tree.xpath(self.__hits_xpath):
+            hit: dict[str, Any] = {"link": None, "name": "#"}
+            link_elems = result_elem.xpath(".//a")
+            if len(link_elems) > 0:
+                hit["link"] = link_elems[0].attrib["href"]
+                hit["name"] = link_elems[0].text_content().strip()
+            hit["info"] = parse_hit(lxml_html.tostring(result_elem, encoding="unicode"), hit["name"])
+            hits.append(hit)
+        return hits
+
+    def parse_detail(self, text: str, info: dict[str, str]):
+        tree = lxml_html.fromstring(text)
+        cards = tree.xpath(self.__cards_xpath)
+
+        # address
+        p_elems = cards[0].xpath(".//p")
+        if len(p_elems) > 0:
+            parse_address(self.__lines(p_elems[0]), info)
+        else:
+            log_err("p_elem is none")
+
+        if len(cards) > 1:
+            p_elems = cards[1].xpath(".//p")
+            if len(p_elems) > 0:
+                # email
+                email_elems = p_elems[0].xpath(self.__mail_xpath)
+                if len(email_elems) > 0:
+                    email = email_elems[0].text_content().strip()
+                    info["email"] = email.replace("--at--", "@")
+                else:
+                    log_err("email elem is none")
+
+                # phone
+                parse_contact(self.__lines(p_elems[0]), info)
+            else:
+                log_err("p_elem is none")
+        else:
+            log_err("no contact")
+
+
+def class_pattern(tag: str, *names: str) -> str:
+    lookaheads = "".join([rf'(?=[^"]*(?<![\w-]){re.escape(name)}(?![\w-]))' for name in names])
+    return rf'<{tag}\s[^>]*class="{lookaheads}[^"]*"[^>]*>'
+
+
+CONTAINER_RE = re.compile(class_pattern("div", "container", "content"))
+ROW_RE = re.compile(class_pattern("div", "row"))
+CARD_RE = re.compile(class_pattern("div", "col-md-3"))
+P_RE = re.compile(r"<p(?:\s[^>]*)?>(.*?)</p>", re.S)
+BR_RE = re.compile(r"<br\s*/?>", re.I)
+MAIL_RE = re.compile(class_pattern("a", "mail") + r"(.*?)</a>", re.S)
+MAIL_HINT_RE = re.compile(r'class="[^"]*mail')
+TAG_RE = re.compile(r"<[^>]+>")
+ZIP_RE = re.compile(r"^\d{5}$")
+DIV_OPEN_RE = re.compile(r"<div[\s>]")
+DIV_CLOSE_RE = re.compile(r"</div\s*>")
+
+
+ZIP_CITY_RE = re.compile(r"^(\d{5})\s+(.+)$")
+BLOCK_END_RE = re.compile(r"<br\s*/?>|</?(?:p|div|li|ul|address|h\d|table|tr|td)(?:\s[^>]*)?>", re.I)
+
+
+def hit_lines(contents: str) -> list[str]:
+    lines = []
+    for line in BLOCK_END_RE.split(contents):
+        line = " ".join(normalize(TAG_RE.sub("", line)).split())
+        if line != "":
+            lines.append(line)
+    return lines
+
+
+def parse_hit(contents: str, name: str) -> dict[str, str]:
+    """
+    Harvests the fields a list page hit already shows. Only found fields are returned.
+    """
+    info = {}
+    lines = hit_lines(contents)
+
+    # address: "<zip> <city>" line preceded by the street
+    for i in range(1, len(lines)):
+        m = ZIP_CITY_RE.match(lines[i])
+        if m != None and lines[i - 1] != name:
+            info["address"] = f"{m.group(2)} {lines[i - 1]}"
+            break
+
+    # email
+    m = MAIL_RE.search(contents)
+    if m != None:
+        email = html.unescape(TAG_RE.sub("", m.group(1))).strip()
+        if email != "":
+            info["email"] = email.replace("--at--", "@")
+
+    # phone
+    contact = {}
+    parse_contact(lines, contact)
+    for key, value in contact.items():
+        if value != "":
+            info[key] = value
+    return info
+
+
+TOTAL_RE = re.compile(r"(\d{1,3}(?:\.\d{3})+|\d+)\s+(?:Treffer|Ergebnisse|Suchergebnisse|Betriebe)\b")
+
+
+def parse_total(text: str) -> Optional[int]:
+    """
+    Returns the hit count a search page reports, e.g. "27.154 Treffer", or None if the page shows none.
+    """
+    m = TOTAL_RE.search(" ".join(html.unescape(TAG_RE.sub(" ", text)).split()))
+    if m != None:
+        return int(m.group(1).replace(".", ""))
+    return None
+
+
+class FastPathError(Exception):
+    pass
+
+
+def normalize(text: str) -> str:
+    # same escaping as the soup tree serializes in decode_contents()
+    return html.escape(html.unescape(text), quote=False)
+
+
+class RegexParser:
+    """
+    Extracts the detail contact card with compiled patterns straight from the response text.
+    Results are validated and the page is handed to the DOM `fallback` parser whenever the fast path fails.
+    """
+
+    def __init__(self, fallback: "Parser"):
+        self.__fallback = fallback
+        self.__lock = threading.Lock()
+        self.__hit_count = 0
+        self.__fallback_count = 0
+
+    @property
+    def fallback_count(self) -> int:
+        return self.__fallback_count
+
+    @property
+    def hit_count(self) -> int:
+        return self.__hit_count
+
+    def __card_contents(self, text: str) -> list[Optional[str]]:
+        container = CONTAINER_RE.search(text)
+        if container == None:
+            raise FastPathError("container not found")
+
+        rows = list(ROW_RE.finditer(text, container.end()))
+        if len(rows) < 2:
+            raise FastPathError("second row not found")
+
+        # the first row has to be closed before the second one starts, otherwise the second match is nested
+        first_row = text[rows[0].start() : rows[1].start()]
+        if len(DIV_OPEN_RE.findall(first_row)) != len(DIV_CLOSE_RE.findall(first_row)):
+            raise FastPathError("rows are nested")
+
+        row_end = rows[2].start() if len(rows) > 2 else len(text)
+        row = text[rows[1].end() : row_end]
+
+        cards = list(CARD_RE.finditer(row))
+        if len(cards) == 0:
+            raise FastPathError("no card")
+
+        contents = []
+        for i, card in enumerate(cards):
+            card_end = cards[i + 1].start() if i + 1 < len(cards) else len(row)
+            m = P_RE.search(row, card.end(), card_end)
+            contents.append(m.group(1) if m != None else None)
+        return contents
+
+    def __parse(self, text: str, info: dict[str, str]):
+        contents = self.__card_contents(text)
+
+        # address
+        if contents[0] == None:
+            raise FastPathError("no address")
+        words = [normalize(word) for word in BR_RE.split(contents[0])]
+        if len(words) < 3 or " " not in words[2].strip():
+            raise FastPathError("unexpected address")
+        parse_address(words, info)
+        if not ZIP_RE.match(words[2].strip().split(" ", 1)[0]):
+            raise FastPathError("unexpected zip")
+
+        if len(contents) > 1 and contents[1] != None:
+            # email
+            m = MAIL_RE.search(contents[1])
+            if m != None:
+                email = html.unescape(TAG_RE.sub("", m.group(1))).strip()
+                info["email"] = email.replace("--at--", "@")
+            elif MAIL_HINT_RE.search(contents[1]) != None:
+                raise FastPathError("unexpected email")
+
+            # phone
+            parse_contact([normalize(word) for word in BR_RE.split(contents[1])], info)
+
+        for value in info.values():
+            if "<" in value or ">" in value:
+                raise FastPathError("markup in field")
+
+    def parse_list(self, text: str) -> list[dict[str, Any]]:
+        return self.__fallback.parse_list(text)
+
+    def parse_detail(self, text: str, info: dict[str, str]):
+        fast_info = dict(info)
+        try:
+            self.__parse(text, fast_info)
+            info.update(fast_info)
+            with self.__lock:
+                self.__hit_count += 1
+            return
+        except (FastPathError, IndexError) as e:
+            with self.__lock:
+                self.__fallback_count += 1
+            log_dbg(f"regex fast path failed ({e}), fallback to dom")
+        self.__fallback.parse_detail(text, info)
+
+
+Parser = Union[SoupParser, LxmlParser, RegexParser]
+
+
+def css_to_xpath(selector: str) -> str:
+    from cssselect import GenericTranslator
+
+    return GenericTranslator().css_to_xpath(selector)
+
+
+def get_parser(
+    name: str = "html.parser",
+    strain: bool = False,
+    fast_path: bool = False,
+    hit_selector: str = HIT_SELECTOR,
+    card_selector: str = CARD_SELECTOR,
+) -> Parser:
+    # strainers and the fast path are built for the default layout only
+    if hit_selector != HIT_SELECTOR or card_selector != CARD_SELECTOR:
+        if strain or fast_path:
+            log_inf("custom selectors: restricted subtree and regex fast path are disabled")
+        strain = False
+        fast_path = False
+
+    if name == "lxml-tree":
+        parser = LxmlParser(hit_selector=hit_selector, card_selector=card_selector)
+    else:
+        parser = SoupParser(features=name, strain=strain, hit_selector=hit_selector, card_selector=card_selector)
+    if fast_path:
+        parser = RegexParser(fallback=parser)
+    return parser
+
+
+if __name__ == "__main__":
+
+    def main():
+        """
+        Parity check of every backend against the html.parser reference on saved detail pages.
+        Usage: python libparser.py page1.html page2.html ...
+        """
+        reference = get_parser("html.parser")
+        candidates = {
+            "html.parser+strain": get_parser("html.parser", strain=True),
+            "lxml": get_parser("lxml"),
+            "lxml+strain": get_parser("lxml", strain=True),
+            "lxml-tree": get_parser("lxml-tree"),
+            "regex": get_parser("html.parser", fast_path=True),
+        }
+        mismatch_count = 0
+        for fpath in sys.argv[1:]:
+            with open(fpath, "r", encoding="utf-8") as f:
+                text = f.read()
+            try:
+                expected = new_info()
+                reference.parse_detail(text, expected)
+                for name, parser in candidates.items():
+                    actual = new_info()
+                    parser.parse_detail(text, actual)
+                    if actual != expected:
+                        mismatch_count += 1
+                        log_err(f"{name} mismatch on {fpath}\n{expected}\n{actual}")
+            except:
+                traceback.print_exc()
+        log_inf(f"{len(sys.argv) - 1} files checked, {mismatch_count} mismatches")
+
+    main()
@@ -0,0 +1,127 @@
+import queue
+import threading
+import traceback
+from typing import Any, Callable, Optional
+
+STOP = object()
+
+
+class Stage:
+    """
+    Threads taking items from a bounded queue. A full queue blocks whoever puts into it,
+    so a slow stage holds back the stages before it instead of buffering without limit.
+    With a `batch_size`, `handle` gets a list of up to that many items already queued instead of one item.
+    """
+
+    def __init__(self, name: str, handle: Callable[[Any], None], workers: int, queue_size: int, batch_size: Optional[int] = None):
+        self.name = name
+        self.__handle = handle
+        self.__workers = max(workers, 1)
+        self.__batch_size = batch_size
+        self.__queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.__lock = threading.Lock()
+        self.__alive = 0
+        self.__threads: list[threading.Thread] = []
+        self.__next: Optional["Stage"] = None
+        self.handled = 0
+
+    def connect(self, next_stage: "Stage"):
+        self.__next = next_stage
+
+    def put(self, item: Any):
+        self.__queue.put(item)
+
+    def close(self):
+        for _ in range(self.__workers):
+            self.__queue.put(STOP)
+
+    def __take(self) -> tuple[list[Any], bool]:
+        """
+        Returns the next items and whether this worker got its stop.
+        """
+        item = self.__queue.get()
+        if item is STOP:
+            return [], True
+        items = [item]
+        while self.__batch_size != None and len(items) < self.__batch_size:
+            # a batch never waits for items to come
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is STOP:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def __run(self):
+        stop = False
+        while not stop:
+            items, stop = self.__take()
+            if len(items) == 0:
+                continue
+            try:
+                if self.__batch_size != None:
+                    self.__handle(items)
+                else:
+                    self.__handle(items[0])
+            except:
+                traceback.print_exc()
+            with self.__lock:
+                self.handled += len(items)
+
+        # the last worker to stop closes the next stage, items only flow downstream
+        with self.__lock:
+            self.__alive -= 1
+            last = self.__alive == 0
+        if last and self.__next != None:
+            self.__next.close()
+
+    def start(self):
+        self.__alive = self.__workers
+        for i in range(self.__workers):
+            thread = threading.Thread(target=self.__run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        for thread in self.__threads:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+        return True
+
+    def describe(self) -> str:
+        return f"{self.name} {self.handled} done, {self.__queue.qsize()} queued, {self.__workers} workers"
+
+
+class Pipeline:
+    """
+    Stages in a row. A stage may put into any later stage; closing the first stage stops them in order.
+    """
+
+    def __init__(self):
+        self.__stages: list[Stage] = []
+
+    def add(self, name: str, handle: Callable[[Any], None], workers: int, queue_size: int, batch_size: Optional[int] = None) -> Stage:
+        stage = Stage(name=name, handle=handle, workers=workers, queue_size=queue_size, batch_size=batch_size)
+        if len(self.__stages) > 0:
+            self.__stages[-1].connect(stage)
+        self.__stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.__stages:
+            stage.start()
+
+    def close(self):
+        self.__stages[0].close()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        for stage in self.__stages:
+            if not stage.join(timeout):
+                return False
+        return True
+
+    def describe(self) -> str:
+        return " | ".join([stage.describe() for stage in self.__stages])
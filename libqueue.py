@@ -0,0 +1,389 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional, Union
+
+import requests
+
+from liblogger import log_err, log_inf
+
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+# failed `max_attempts` times, left to --retry-failed
+STATE_FAILED = "failed"
+
+
+class Lease:
+    def __init__(self, site: str, page_index: int, token: str, owner: str, expires: float):
+        self.site = site
+        self.page_index = page_index
+        self.token = token
+        self.owner = owner
+        self.expires = expires
+
+    def to_json(self) -> dict[str, Any]:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_json(jobj: dict[str, Any]) -> "Lease":
+        return Lease(**jobj)
+
+
+class SqliteWorkQueue:
+    """
+    Page queue in a SQLite file. A node leases pages for `lease_time` seconds and keeps them
+    with heartbeats; pages whose lease ran out are handed to the next node that asks.
+    Safe for several processes on one host, use QueueServer to share it across hosts.
+    A page a node failed on goes back to the other nodes first, until it failed `max_attempts` times.
+    """
+
+    def __init__(self, fpath: str, lease_time: float = 300.0, max_attempts: int = 3):
+        self.__fpath = fpath
+        self.__lease_time = lease_time
+        self.__max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+        with closing(self.__connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "site TEXT NOT NULL, page_index INTEGER NOT NULL, state TEXT NOT NULL, "
+                "owner TEXT, token TEXT, expires REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (site, page_index))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_state ON pages (site, state, expires)")
+            # every node that failed on a page, so none of them gets it before the others had a try
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS failures ("
+                "site TEXT NOT NULL, page_index INTEGER NOT NULL, owner TEXT NOT NULL, "
+                "PRIMARY KEY (site, page_index, owner))"
+            )
+
+    def __connect(self) -> sqlite3.Connection:
+        # autocommit, transactions are opened explicitly
+        return sqlite3.connect(self.__fpath, timeout=30.0, isolation_level=None)
+
+    def add(self, site: str, page_indices: list[int]) -> int:
+        """
+        Queues pages that are not known yet, finished pages stay finished. Returns the number of new pages.
+        """
+        with closing(self.__connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO pages (site, page_index, state) VALUES (?, ?, ?)",
+                [(site, page_index, STATE_PENDING) for page_index in page_indices],
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        return added
+
+    def lease(self, site: str, owner: str) -> Optional[Lease]:
+        """
+        Leases the lowest pending page of `site`, or a page whose lease expired. Returns None if there is none.
+        Pages `owner` failed on come last, so they go to the other nodes first and a single node still retries them.
+        """
+        now = time.time()
+        with closing(self.__connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT page_index, state, owner FROM pages WHERE site = ? AND (state = ? OR (state = ? AND expires < ?)) "
+                "ORDER BY EXISTS (SELECT 1 FROM failures WHERE failures.site = pages.site AND failures.page_index = pages.page_index AND failures.owner = ?), "
+                "page_index LIMIT 1",
+                (site, STATE_PENDING, STATE_LEASED, now, owner),
+            ).fetchone()
+            if row == None:
+                conn.execute("COMMIT")
+                return None
+
+            page_index, state, old_owner = row
+            lease = Lease(site=site, page_index=page_index, token=uuid.uuid4().hex, owner=owner, expires=now + self.__lease_time)
+            conn.execute(
+                "UPDATE pages SET state = ?, owner = ?, token = ?, expires = ? WHERE site = ? AND page_index = ?",
+                (STATE_LEASED, owner, lease.token, lease.expires, site, page_index),
+            )
+            conn.execute("COMMIT")
+
+        if state == STATE_LEASED:
+            log_inf(f"queue: reclaim {site} page {page_index} from {old_owner} for {owner}")
+        return lease
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """
+        Extends the lease. Returns False if the lease was lost to another node.
+        """
+        expires = time.time() + self.__lease_time
+        with closing(self.__connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE pages SET expires = ? WHERE site = ? AND page_index = ? AND state = ? AND token = ?",
+                (expires, lease.site, lease.page_index, STATE_LEASED, lease.token),
+            )
+            if cursor.rowcount == 0:
+                return False
+        lease.expires = expires
+        return True
+
+    def complete(self, lease: Lease):
+        # a finished page is done even if its lease was reclaimed in the meantime
+        with closing(self.__connect()) as conn:
+            conn.execute(
+                "UPDATE pages SET state = ?, owner = ?, token = NULL WHERE site = ? AND page_index = ?",
+                (STATE_DONE, lease.owner, lease.site, lease.page_index),
+            )
+
+    def release(self, lease: Lease):
+        with closing(self.__connect()) as conn:
+            conn.execute(
+                "UPDATE pages SET state = ?, owner = NULL, token = NULL, expires = 0 WHERE site = ? AND page_index = ? AND state = ? AND token = ?",
+                (STATE_PENDING, lease.site, lease.page_index, STATE_LEASED, lease.token),
+            )
+
+    def fail(self, lease: Lease):
+        """
+        Hands a page the node failed on to the other nodes, or gives up on it after `max_attempts` failures.
+        Only failures count, a lease that expired on a node does not.
+        """
+        with closing(self.__connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "UPDATE pages SET state = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END, owner = NULL, token = NULL, expires = 0, attempts = attempts + 1 "
+                "WHERE site = ? AND page_index = ? AND state = ? AND token = ?",
+                (self.__max_attempts, STATE_FAILED, STATE_PENDING, lease.site, lease.page_index, STATE_LEASED, lease.token),
+            )
+            if cursor.rowcount > 0:
+                conn.execute("INSERT OR IGNORE INTO failures (site, page_index, owner) VALUES (?, ?, ?)", (lease.site, lease.page_index, lease.owner))
+            conn.execute("COMMIT")
+
+    def stats(self, site: str) -> dict[str, int]:
+        ret = {STATE_PENDING: 0, STATE_LEASED: 0, STATE_DONE: 0, STATE_FAILED: 0}
+        with closing(self.__connect()) as conn:
+            for state, count in conn.execute("SELECT state, COUNT(*) FROM pages WHERE site = ? GROUP BY state", (site,)):
+                ret[state] = count
+        return ret
+
+
+class QueueServer:
+    """
+    Serves a SqliteWorkQueue over HTTP as JSON POST requests, one path per queue method.
+    """
+
+    def __init__(self, queue: SqliteWorkQueue, host: str = "0.0.0.0", port: int = 8765):
+        self.__queue = queue
+        self.__server = ThreadingHTTPServer((host, port), self.__handler())
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.__server.server_address[1]
+
+    def __call(self, method: str, jobj: dict[str, Any]) -> Any:
+        if method == "add":
+            return self.__queue.add(jobj["site"], jobj["page_indices"])
+        elif method == "lease":
+            lease = self.__queue.lease(jobj["site"], jobj["owner"])
+            return lease.to_json() if lease != None else None
+        elif method == "heartbeat":
+            lease = Lease.from_json(jobj["lease"])
+            return {"alive": self.__queue.heartbeat(lease), "expires": lease.expires}
+        elif method == "complete":
+            return self.__queue.complete(Lease.from_json(jobj["lease"]))
+        elif method == "release":
+            return self.__queue.release(Lease.from_json(jobj["lease"]))
+        elif method == "fail":
+            return self.__queue.fail(Lease.from_json(jobj["lease"]))
+        elif method == "stats":
+            return self.__queue.stats(jobj["site"])
+        raise KeyError(method)
+
+    def __handler(self):
+        call = self.__call
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status, body = 200, b""
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    jobj = json.loads(self.rfile.read(length) or b"{}")
+                    body = json.dumps(call(self.path.strip("/"), jobj)).encode()
+                except KeyError:
+                    status = 404
+                except:
+                    traceback.print_exc()
+                    status = 500
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any):
+                pass
+
+        return Handler
+
+    def start(self):
+        if self.__thread == None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+            self.__thread.start()
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread = None
+
+
+class RemoteWorkQueue:
+    """
+    Client of a QueueServer with the interface of SqliteWorkQueue.
+    """
+
+    def __init__(self, url: str):
+        self.__url = url.rstrip("/")
+        self.__session = requests.Session()
+
+    def __call(self, method: str, jobj: dict[str, Any]) -> Any:
+        while True:
+            try:
+                resp = self.__session.post(f"{self.__url}/{method}", json=jobj, timeout=30.0)
+                if resp.status_code == 200:
+                    return resp.json()
+                log_err(f"queue {method}: {resp.status_code}")
+            except:
+                traceback.print_exc()
+            time.sleep(5.0)
+
+    def add(self, site: str, page_indices: list[int]) -> int:
+        return self.__call("add", {"site": site, "page_indices": page_indices})
+
+    def lease(self, site: str, owner: str) -> Optional[Lease]:
+        jobj = self.__call("lease", {"site": site, "owner": owner})
+        return Lease.from_json(jobj) if jobj != None else None
+
+    def heartbeat(self, lease: Lease) -> bool:
+        ret = self.__call("heartbeat", {"lease": lease.to_json()})
+        lease.expires = ret["expires"]
+        return ret["alive"]
+
+    def complete(self, lease: Lease):
+        self.__call("complete", {"lease": lease.to_json()})
+
+    def release(self, lease: Lease):
+        self.__call("release", {"lease": lease.to_json()})
+
+    def fail(self, lease: Lease):
+        self.__call("fail", {"lease": lease.to_json()})
+
+    def stats(self, site: str) -> dict[str, int]:
+        return self.__call("stats", {"site": site})
+
+
+WorkQueue = Union[SqliteWorkQueue, RemoteWorkQueue]
+
+
+def open_queue(spec: str, lease_time: float = 300.0) -> WorkQueue:
+    """
+    Opens a queue server for http(s) urls, otherwise the SQLite file at `spec`.
+    """
+    if spec.startswith("http://") or spec.startswith("https://"):
+        return RemoteWorkQueue(spec)
+    return SqliteWorkQueue(spec, lease_time=lease_time)
+
+
+class LeaseKeeper:
+    """
+    Sends heartbeats for the leases a node holds, every `interval` seconds.
+    """
+
+    def __init__(self, queue: WorkQueue, interval: float):
+        self.__queue = queue
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__leases: dict[tuple[str, int], Lease] = {}
+        self.__running = False
+        self.__thread: Optional[threading.Thread] = None
+
+    def __beat(self):
+        while self.__running:
+            time.sleep(self.__interval)
+            with self.__lock:
+                leases = list(self.__leases.values())
+            for lease in leases:
+                try:
+                    if not self.__queue.heartbeat(lease):
+                        log_err(f"queue: lost lease of {lease.site} page {lease.page_index}")
+                        self.drop(lease)
+                except:
+                    traceback.print_exc()
+
+    def hold(self, lease: Lease):
+        with self.__lock:
+            self.__leases[(lease.site, lease.page_index)] = lease
+
+    def drop(self, lease: Lease):
+        with self.__lock:
+            self.__leases.pop((lease.site, lease.page_index), None)
+
+    def start(self):
+        if self.__thread == None:
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__beat, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        self.__thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a page queue to crawler.py --queue http://<host>:<port> on other hosts.")
+    parser.add_argument(
+        "--db",
+        dest="db",
+        type=str,
+        default=os.path.join("temp", "queue.sqlite"),
+        required=False,
+        help="SQLite file of the queue. Default is temp/queue.sqlite.",
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=8765,
+        required=False,
+        help="Port to listen on. Default is 8765.",
+    )
+    parser.add_argument(
+        "--lease-time",
+        dest="lease_time",
+        type=float,
+        default=300.0,
+        required=False,
+        help="Seconds a lease lasts without heartbeat before its page is reclaimed. Default is 300.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        dest="max_attempts",
+        type=int,
+        default=3,
+        required=False,
+        help="Times a page may fail before the queue gives up on it. Default is 3.",
+    )
+    args = parser.parse_args()
+
+    server = QueueServer(SqliteWorkQueue(args.db, lease_time=args.lease_time, max_attempts=args.max_attempts), port=args.port)
+    log_inf(f"queue: serve {args.db} on port {server.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from liblogger import log_inf
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        self._rate = max(rate, 0.001)
+        self._lock = threading.Lock()
+        self.__next_tstamp = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def acquire(self) -> float:
+        """
+        Blocks until the next request slot of this limiter is reached and returns the slot time.
+        Slots are handed out in call order, so concurrent callers share one budget.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.__next_tstamp)
+            self.__next_tstamp = slot + 1.0 / self._rate
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        return slot
+
+    def on_success(self):
+        pass
+
+    def on_failure(self, slot: float):
+        pass
+
+
+class AimdRateLimiter(RateLimiter):
+    """
+    Additive increase / multiplicative decrease rate control.
+    Clean responses raise the rate by `increase` req/s per second, a failed one multiplies it by `decrease`.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float = 0.1,
+        max_rate: float = 10.0,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        name: str = "",
+    ):
+        super().__init__(rate)
+        self.__min_rate = max(min_rate, 0.001)
+        self.__max_rate = max(max_rate, self.__min_rate)
+        self.__increase = increase
+        self.__decrease = decrease
+        self.__name = name
+        self.__backoff_tstamp = 0.0
+        self._rate = min(max(self._rate, self.__min_rate), self.__max_rate)
+
+    def on_success(self):
+        with self._lock:
+            self._rate = min(self.__max_rate, self._rate + self.__increase / self._rate)
+
+    def on_failure(self, slot: float):
+        with self._lock:
+            # requests issued before the last back off saw the old rate, count them only once
+            if slot < self.__backoff_tstamp:
+                return
+            self.__backoff_tstamp = time.monotonic()
+            self._rate = max(self.__min_rate, self._rate * self.__decrease)
+            rate = self._rate
+        log_inf(f"{self.__name} back off > {rate:.2f} req/s")
+
+
+class HostRateLimiter:
+    def __init__(self, rate: float, min_rate: float = 0.1, max_rate: float = 10.0):
+        self.__rate = rate
+        self.__min_rate = min_rate
+        self.__max_rate = max_rate
+        self.__lock = threading.Lock()
+        self.__limiters: dict[str, RateLimiter] = {}
+
+    def get(self, url: str) -> RateLimiter:
+        host = urlparse(url).netloc.lower()
+        with self.__lock:
+            limiter = self.__limiters.get(host)
+            if limiter == None:
+                limiter = AimdRateLimiter(
+                    rate=self.__rate,
+                    min_rate=self.__min_rate,
+                    max_rate=self.__max_rate,
+                    name=host,
+                )
+                self.__limiters[host] = limiter
+        return limiter
+
+    def acquire(self, url: str) -> float:
+        return self.get(url).acquire()
+
+    def rate(self, url: str) -> Optional[float]:
+        limiter = self.__limiters.get(urlparse(url).netloc.lower())
+        if limiter != None:
+            return limiter.rate
+        return None
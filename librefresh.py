@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+def hit_fingerprint(hit: dict[str, Any]) -> str:
+    """
+    Fingerprint of everything a list page shows about one hit.
+    """
+    data = json.dumps([hit["link"], hit["name"], hit["info"]], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class KnownHit:
+    def __init__(self, link: str, fingerprint: str, info: dict[str, Any], etag: str, last_modified: str, first_seen: float, last_seen: float):
+        self.link = link
+        self.fingerprint = fingerprint
+        self.info = info
+        self.etag = etag
+        self.last_modified = last_modified
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+
+
+def validator_headers(etag: str, last_modified: str) -> dict[str, str]:
+    headers = {}
+    if etag != "":
+        headers["If-None-Match"] = etag
+    if last_modified != "":
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class RefreshIndex:
+    """
+    What the last runs saw: validators and hit links of every list page, and fingerprint,
+    record, validators and first/last seen time of every detail link.
+    """
+
+    def __init__(self, fpath: str):
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+        self.__conn = sqlite3.connect(fpath, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT NOT NULL, last_modified TEXT NOT NULL, links TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS hits ("
+            "link TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, info TEXT NOT NULL, etag TEXT NOT NULL, last_modified TEXT NOT NULL, "
+            "first_seen REAL NOT NULL, last_seen REAL NOT NULL)"
+        )
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+    def page_headers(self, url: str) -> dict[str, str]:
+        with self.__lock:
+            row = self.__conn.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        return validator_headers(row[0], row[1]) if row != None else {}
+
+    def page_links(self, url: str) -> Optional[list[str]]:
+        with self.__lock:
+            row = self.__conn.execute("SELECT links FROM pages WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row != None else None
+
+    def put_page(self, url: str, headers: Any, links: list[str]):
+        with self.__lock:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (url, headers.get("ETag", ""), headers.get("Last-Modified", ""), json.dumps(links), time.time()),
+            )
+
+    def touch_page(self, url: str):
+        """
+        Marks a page that was not modified and its hits as seen now.
+        """
+        now = time.time()
+        links = self.page_links(url) or []
+        with self.__lock:
+            self.__conn.execute("BEGIN")
+            self.__conn.execute("UPDATE pages SET last_seen = ? WHERE url = ?", (now, url))
+            self.__conn.executemany("UPDATE hits SET last_seen = ? WHERE link = ?", [(now, link) for link in links])
+            self.__conn.execute("COMMIT")
+
+    def get(self, link: str) -> Optional[KnownHit]:
+        with self.__lock:
+            row = self.__conn.execute("SELECT * FROM hits WHERE link = ?", (link,)).fetchone()
+        if row == None:
+            return None
+        return KnownHit(
+            link=row[0],
+            fingerprint=row[1],
+            info=json.loads(row[2]),
+            etag=row[3],
+            last_modified=row[4],
+            first_seen=row[5],
+            last_seen=row[6],
+        )
+
+    def put(self, link: str, fingerprint: str, info: dict[str, Any], etag: str = "", last_modified: str = ""):
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute(
+                "INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (link) DO UPDATE SET "
+                "fingerprint = excluded.fingerprint, info = excluded.info, etag = excluded.etag, "
+                "last_modified = excluded.last_modified, last_seen = excluded.last_seen",
+                (link, fingerprint, json.dumps(info), etag, last_modified, now, now),
+            )
@@ -0,0 +1,226 @@
+import json
+import os
+import random
+import threading
+import time
+import traceback
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from liblogger import log_err, log_inf
+
+FAILURE_CHALLENGE = "challenge"
+FAILURE_RATE_LIMITED = "rate_limited"
+FAILURE_SERVER = "server"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_NETWORK = "network"
+FAILURE_NOT_FOUND = "not_found"
+FAILURE_CLIENT = "client"
+
+# failures that tell something about the url, not about the health of the host
+URL_FAILURES = [FAILURE_NOT_FOUND, FAILURE_CLIENT]
+
+
+class RetryClass:
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+
+RETRY_CLASSES = {
+    # the cookie refresh is the remedy, the delay only spaces the attempts
+    FAILURE_CHALLENGE: RetryClass(max_attempts=10, base_delay=1.0, max_delay=30.0),
+    FAILURE_RATE_LIMITED: RetryClass(max_attempts=8, base_delay=10.0, max_delay=300.0),
+    FAILURE_SERVER: RetryClass(max_attempts=6, base_delay=2.0, max_delay=120.0),
+    FAILURE_TIMEOUT: RetryClass(max_attempts=6, base_delay=2.0, max_delay=60.0),
+    FAILURE_NETWORK: RetryClass(max_attempts=6, base_delay=5.0, max_delay=120.0),
+    FAILURE_NOT_FOUND: RetryClass(max_attempts=1, base_delay=0.0, max_delay=0.0),
+    FAILURE_CLIENT: RetryClass(max_attempts=2, base_delay=1.0, max_delay=10.0),
+}
+
+
+class FetchError(Exception):
+    def __init__(self, url: str, failure: str, attempts: int):
+        super().__init__(f"{failure} after {attempts} attempts: {url}")
+        self.url = url
+        self.failure = failure
+        self.attempts = attempts
+
+
+def classify_response(status_code: int, text: str) -> Optional[str]:
+    """
+    Returns the failure class of a response, None for a success.
+    """
+    if status_code in [200, 304]:
+        if status_code == 200 and "Just a moment..." in text:
+            return FAILURE_CHALLENGE
+        return None
+    if status_code in [403, 503]:
+        return FAILURE_CHALLENGE
+    if status_code == 429:
+        return FAILURE_RATE_LIMITED
+    if status_code in [404, 410]:
+        return FAILURE_NOT_FOUND
+    if status_code >= 500:
+        return FAILURE_SERVER
+    return FAILURE_CLIENT
+
+
+def classify_exception(e: Exception) -> str:
+    if isinstance(e, requests.Timeout):
+        return FAILURE_TIMEOUT
+    return FAILURE_NETWORK
+
+
+class RetryPolicy:
+    """
+    Counts the attempts of one url per failure class and tells how long to back off before the next one.
+    """
+
+    def __init__(self, retry_classes: dict[str, RetryClass] = RETRY_CLASSES):
+        self.__retry_classes = retry_classes
+        self.__attempts: dict[str, int] = {}
+
+    def on_failure(self, failure: str) -> bool:
+        """
+        Counts a failure. Returns False if the budget of its class is exhausted.
+        """
+        self.__attempts[failure] = self.__attempts.get(failure, 0) + 1
+        return self.__attempts[failure] < self.__retry_classes[failure].max_attempts
+
+    def attempts(self) -> int:
+        return sum(self.__attempts.values())
+
+    def delay(self, failure: str) -> float:
+        # exponential backoff with full jitter
+        retry_class = self.__retry_classes[failure]
+        attempt = self.__attempts.get(failure, 1)
+        return random.uniform(0.0, min(retry_class.max_delay, retry_class.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures of a host and holds every request for a cooldown.
+    Afterwards requests go through again; the next failure reopens it with a doubled cooldown.
+    """
+
+    def __init__(self, name: str, threshold: int = 10, cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.__name = name
+        self.__threshold = threshold
+        self.__base_cooldown = cooldown
+        self.__cooldown = cooldown
+        self.__max_cooldown = max_cooldown
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__open_until = 0.0
+        self.__half_open = False
+
+    def wait(self):
+        while True:
+            with self.__lock:
+                wait_time = self.__open_until - time.time()
+            if wait_time <= 0:
+                break
+            time.sleep(min(wait_time, 5.0))
+
+    def on_success(self):
+        with self.__lock:
+            if self.__half_open:
+                log_inf(f"circuit of {self.__name} closed")
+            self.__failures = 0
+            self.__half_open = False
+            self.__cooldown = self.__base_cooldown
+
+    def on_failure(self):
+        with self.__lock:
+            now = time.time()
+            if now < self.__open_until:
+                # failures of requests sent before the circuit opened
+                return
+            self.__failures += 1
+            if self.__half_open:
+                self.__cooldown = min(self.__cooldown * 2.0, self.__max_cooldown)
+            if self.__half_open or self.__failures >= self.__threshold:
+                self.__open_until = now + self.__cooldown
+                self.__half_open = True
+                self.__failures = 0
+                log_err(f"circuit of {self.__name} open for {self.__cooldown:.0f}s")
+
+
+class HostCircuitBreaker:
+    def __init__(self, threshold: int = 10, cooldown: float = 30.0):
+        self.__threshold = threshold
+        self.__cooldown = cooldown
+        self.__lock = threading.Lock()
+        self.__breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        host = urlparse(url).netloc.lower()
+        with self.__lock:
+            breaker = self.__breakers.get(host)
+            if breaker == None:
+                breaker = CircuitBreaker(name=host, threshold=self.__threshold, cooldown=self.__cooldown)
+                self.__breakers[host] = breaker
+        return breaker
+
+
+class DeadLetter:
+    """
+    JSON lines file of the fetches that exhausted their retry budget, replayed by a later run.
+    """
+
+    def __init__(self, fpath: str):
+        self.__fpath = fpath
+        self.__lock = threading.Lock()
+
+    def park(self, entry: dict[str, Any]):
+        try:
+            entry = {**entry, "tstamp": time.time()}
+            with self.__lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.__fpath)), exist_ok=True)
+                with open(self.__fpath, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except:
+            traceback.print_exc()
+
+    def entries(self, site: str) -> list[dict[str, Any]]:
+        """
+        Returns the entries of `site`, they stay in the file until they are removed after their replay.
+        """
+        ret = []
+        try:
+            with self.__lock:
+                if not os.path.isfile(self.__fpath):
+                    return ret
+                with open(self.__fpath, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip() != "":
+                            entry = json.loads(line)
+                            if entry["site"] == site:
+                                ret.append(entry)
+        except:
+            traceback.print_exc()
+        return ret
+
+    def remove(self, entries: list[dict[str, Any]]):
+        """
+        Rewrites the file without `entries`, entries parked again in the meantime are kept.
+        """
+        try:
+            with self.__lock:
+                if not os.path.isfile(self.__fpath):
+                    return
+                others = []
+                with open(self.__fpath, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip() != "" and json.loads(line) not in entries:
+                            others.append(line)
+                tmp_fpath = self.__fpath + ".tmp"
+                with open(tmp_fpath, "w", encoding="utf-8") as f:
+                    f.writelines(others)
+                os.replace(tmp_fpath, self.__fpath)
+        except:
+            traceback.print_exc()
@@ -0,0 +1,98 @@
+import threading
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    def __init__(self, pool_size: int = 10, user_agent: str = ""):
+        self.__pool_size = max(pool_size, 1)
+        self.__user_agent = user_agent
+        self.__lock = threading.Lock()
+        self.__sessions: dict[str, requests.Session] = {}
+        self.__cookies: dict[str, list[dict[str, Any]]] = {}
+        self.__user_agents: dict[str, str] = {}
+
+    def __new_session(self, host: str) -> requests.Session:
+        session = requests.Session()
+        session.verify = False
+
+        # keep-alive connections to the host are reused by every worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.__pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        if self.__user_agent != "":
+            session.headers["User-Agent"] = self.__user_agent
+        for domain, user_agent in self.__user_agents.items():
+            if self.__match_domain(host, domain):
+                session.headers["User-Agent"] = user_agent
+
+        for domain, cookies in self.__cookies.items():
+            if self.__match_domain(host, domain):
+                self.__fill_jar(session, domain, cookies)
+        return session
+
+    def __match_domain(self, host: str, domain: str) -> bool:
+        domain = domain.lstrip(".")
+        return host == domain or host.endswith("." + domain)
+
+    def __fill_jar(self, session: requests.Session, domain: str, cookies: list[dict[str, Any]]):
+        # drop the cookies of the previous challenge before filling the new ones
+        for jar_domain in session.cookies.list_domains():
+            if self.__match_domain(jar_domain.lstrip("."), domain):
+                session.cookies.clear(domain=jar_domain)
+
+        for cookie in cookies:
+            session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", domain),
+                path=cookie.get("path", "/"),
+            )
+
+    def get(self, url: str) -> requests.Session:
+        host = urlparse(url).netloc.lower()
+        with self.__lock:
+            session = self.__sessions.get(host)
+            if session == None:
+                session = self.__new_session(host)
+                self.__sessions[host] = session
+        return session
+
+    def set_user_agent(self, user_agent: str, domain: Optional[str] = None):
+        """
+        Sets the user agent of the sessions of `domain`, or the default of every session if `domain` is None.
+        """
+        with self.__lock:
+            if domain == None:
+                self.__user_agent = user_agent
+            else:
+                self.__user_agents[domain] = user_agent
+            for host, session in self.__sessions.items():
+                if domain == None or self.__match_domain(host, domain):
+                    session.headers["User-Agent"] = user_agent
+
+    def set_cookies(self, domain: str, cookies: list[dict[str, Any]]):
+        """
+        Replaces the cookies of `domain` in the jar of every session of a matching host.
+        `cookies` is the list returned by `Chrome.cookie`.
+        """
+        with self.__lock:
+            self.__cookies[domain] = cookies
+            for host, session in self.__sessions.items():
+                if self.__match_domain(host, domain):
+                    self.__fill_jar(session, domain, cookies)
+
+    def close(self, url: Optional[str] = None):
+        with self.__lock:
+            if url != None:
+                session = self.__sessions.pop(urlparse(url).netloc.lower(), None)
+                if session != None:
+                    session.close()
+            else:
+                for session in self.__sessions.values():
+                    session.close()
+                self.__sessions = {}
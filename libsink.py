@@ -0,0 +1,237 @@
+import gzip
+import json
+import os
+import threading
+import time
+import traceback
+import zlib
+from typing import IO, Any, Iterator, Optional
+
+from liblogger import log_inf
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+SEGMENT_EXT = ".jsonl"
+PART_EXT = ".part"
+
+
+def is_segment(fname: str) -> bool:
+    name = fname[: -len(PART_EXT)] if fname.endswith(PART_EXT) else fname
+    return any([name.endswith(SEGMENT_EXT + ext) for ext in COMPRESSIONS.values()])
+
+
+def compress(data: bytes, ext: str) -> bytes:
+    # every batch is a complete gzip member / zstd frame, so a torn write only loses the last batch
+    if ext == ".gz":
+        return gzip.compress(data)
+    elif ext == ".zst":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def new_decompressor(ext: str) -> Any:
+    if ext == ".gz":
+        return zlib.decompressobj(wbits=31)
+    elif ext == ".zst":
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def decompress_chunks(f: IO[bytes], ext: str) -> Iterator[bytes]:
+    """
+    Yields the content of the gzip members / zstd frames of `f` one after another.
+    A torn last member yields what could be decompressed and ends the content.
+    """
+    decompressor = new_decompressor(ext)
+    while True:
+        data = f.read(1 << 16)
+        if len(data) == 0:
+            break
+        if decompressor == None:
+            yield data
+            continue
+        while len(data) > 0:
+            yield decompressor.decompress(data)
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data
+            decompressor = new_decompressor(ext)
+
+
+def read_segment(fpath: str) -> Iterator[dict[str, Any]]:
+    """
+    Yields the entries of a segment, stopping at a torn tail left by a crash.
+    """
+    name = fpath[: -len(PART_EXT)] if fpath.endswith(PART_EXT) else fpath
+    ext = "" if name.endswith(SEGMENT_EXT) else os.path.splitext(name)[1]
+    try:
+        with open(fpath, "rb") as f:
+            rest = b""
+            for chunk in decompress_chunks(f, ext):
+                lines = (rest + chunk).split(b"\n")
+                rest = lines.pop()
+                for line in lines:
+                    if len(line) > 0:
+                        yield json.loads(line)
+    except GeneratorExit:
+        raise
+    except:
+        traceback.print_exc()
+
+
+def iter_segments(output_dir: str) -> Iterator[dict[str, Any]]:
+    """
+    Yields the entries of every shard in `output_dir`, including segments still being written.
+    """
+    if os.path.isdir(output_dir):
+        for fname in sorted(os.listdir(output_dir)):
+            if is_segment(fname):
+                for entry in read_segment(os.path.join(output_dir, fname)):
+                    yield entry
+
+
+def iter_records(output_dir: str) -> Iterator[dict[str, Any]]:
+    """
+    Yields the record entries of `output_dir` ordered by site, page and index.
+    A record written again after a crash replaces the earlier one, whichever shard it is in,
+    since the newest `tstamp` wins; entries of old segments without one count as oldest.
+    """
+    records = {}
+    for entry in iter_segments(output_dir):
+        if "info" in entry:
+            key = (entry["site"], entry["page"], entry["index"])
+            if key not in records or entry.get("tstamp", 0.0) >= records[key].get("tstamp", 0.0):
+                records[key] = entry
+    for key in sorted(records.keys()):
+        yield records[key]
+
+
+class JsonlSink:
+    """
+    Appends records and finished pages as JSON lines to the segments of one shard.
+    Lines are buffered and written in batches, optionally with fsync, and a segment is
+    renamed from .part to its final name once it is full or the sink is closed.
+    A page is written as done after its records, so a crash at worst crawls the last batch again.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        shard: str,
+        compression: str = "gzip",
+        batch_size: int = 200,
+        batch_interval: float = 5.0,
+        fsync: bool = False,
+        segment_size: int = 50000,
+    ):
+        if compression == "zstd" and zstandard == None:
+            raise ImportError("zstandard is not installed")
+        self.__output_dir = output_dir
+        self.__shard = shard
+        self.__ext = SEGMENT_EXT + COMPRESSIONS[compression]
+        self.__batch_size = batch_size
+        self.__batch_interval = batch_interval
+        self.__fsync = fsync
+        self.__segment_size = segment_size
+        self.__lock = threading.Lock()
+        self.__lines: list[bytes] = []
+        self.__flush_tstamp = time.time()
+        self.__file: Optional[IO[bytes]] = None
+        self.__fpath = ""
+        self.__segment_index = 0
+        self.__segment_lines = 0
+        self.__entry_tstamp = 0.0
+
+        # the index of everything written so far makes resume a lookup
+        self.__done: set[tuple[str, int]] = set()
+        self.__records: dict[tuple[str, int], set[int]] = {}
+        os.makedirs(output_dir, exist_ok=True)
+        entry_count = 0
+        for entry in iter_segments(output_dir):
+            self.__index(entry)
+            entry_count += 1
+        log_inf(f"sink: {entry_count} entries, {len(self.__done)} done pages in {output_dir}")
+
+    def __index(self, entry: dict[str, Any]):
+        key = (entry["site"], entry["page"])
+        if entry.get("done", False):
+            self.__done.add(key)
+        else:
+            self.__records.setdefault(key, set()).add(entry["index"])
+
+    def __open_segment(self):
+        while True:
+            self.__fpath = os.path.join(self.__output_dir, f"{self.__shard}-{self.__segment_index:05d}{self.__ext}")
+            self.__segment_index += 1
+            if not os.path.exists(self.__fpath) and not os.path.exists(self.__fpath + PART_EXT):
+                break
+        self.__file = open(self.__fpath + PART_EXT, "ab")
+        self.__segment_lines = 0
+
+    def __close_segment(self):
+        if self.__file != None:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__file.close()
+            self.__file = None
+            os.replace(self.__fpath + PART_EXT, self.__fpath)
+
+    def __flush(self):
+        if len(self.__lines) > 0:
+            if self.__file == None:
+                self.__open_segment()
+            self.__file.write(compress(b"".join(self.__lines), self.__ext[len(SEGMENT_EXT) :]))
+            self.__file.flush()
+            if self.__fsync:
+                os.fsync(self.__file.fileno())
+            self.__segment_lines += len(self.__lines)
+            self.__lines = []
+            if self.__segment_lines >= self.__segment_size:
+                self.__close_segment()
+        self.__flush_tstamp = time.time()
+
+    def __append(self, entry: dict[str, Any]):
+        # strictly increasing within the shard, so a rewrite always orders after the entry it replaces
+        self.__entry_tstamp = max(time.time(), self.__entry_tstamp + 1e-6)
+        entry["tstamp"] = self.__entry_tstamp
+        self.__index(entry)
+        self.__lines.append(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+        if len(self.__lines) >= self.__batch_size or time.time() - self.__flush_tstamp >= self.__batch_interval:
+            self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            self.__close_segment()
+
+    def done_pages(self, site: str) -> set[int]:
+        with self.__lock:
+            return set([page_index for name, page_index in self.__done if name == site])
+
+    def is_done(self, site: str, page_index: int) -> bool:
+        with self.__lock:
+            return (site, page_index) in self.__done
+
+    def has_site(self, site: str) -> bool:
+        with self.__lock:
+            return len([name for name, _ in self.__done if name == site]) > 0 or len([name for name, _ in self.__records if name == site]) > 0
+
+    def record_indices(self, site: str, page_index: int) -> set[int]:
+        with self.__lock:
+            return set(self.__records.get((site, page_index), set()))
+
+    def put_record(self, site: str, page_index: int, info_index: int, info: dict[str, Any]):
+        with self.__lock:
+            self.__append({"site": site, "page": page_index, "index": info_index, "info": info})
+
+    def mark_done(self, site: str, page_index: int):
+        with self.__lock:
+            self.__append({"site": site, "page": page_index, "done": True})
@@ -0,0 +1,89 @@
+import json
+import traceback
+from typing import Any
+
+from liblogger import log_err
+from libparser import CARD_SELECTOR, HIT_SELECTOR
+
+
+class Site:
+    """
+    Declarative profile of one chamber search. `list_url` is a template with {limit} and {offset}.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        home_url: str,
+        base_url: str,
+        cookie_domain: str,
+        list_url: str,
+        total_pages: int,
+        page_size: int = 10,
+        hit_selector: str = HIT_SELECTOR,
+        card_selector: str = CARD_SELECTOR,
+    ):
+        self.name = name
+        self.home_url = home_url
+        self.base_url = base_url
+        self.cookie_domain = cookie_domain
+        self.list_url = list_url
+        self.total_pages = total_pages
+        self.page_size = page_size
+        self.hit_selector = hit_selector
+        self.card_selector = card_selector
+
+    def gen_list_url(self, offset: int, limit: int) -> str:
+        return self.list_url.format(limit=limit, offset=offset)
+
+    def to_json(self) -> dict[str, Any]:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_json(jobj: dict[str, Any]) -> "Site":
+        return Site(**jobj)
+
+
+SITES = {
+    "nuernberg": Site(
+        name="nuernberg",
+        home_url="https://www.hwk-mittelfranken.de/betriebe/suche-75,0,bdbsearch.html?search-searchterm=&search-filter-zipcode=90402&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-training=&search-filter-experience=",
+        base_url="https://www.hwk-mittelfranken.de",
+        cookie_domain=".hwk-mittelfranken.de",
+        list_url="https://www.hwk-mittelfranken.de/betriebe/suche-75,0,bdbsearch.html?search-searchterm=&search-job=&search-local=&search-filter-zipcode=90402&search-filter-latitude=49.453333&search-filter-longitude=11.091667&search-filter-radius=250&search-filter-jobnr=&search-filter-training=&search-filter-experience=&limit={limit}&offset={offset}",
+        total_pages=1439,
+    ),
+    "rostock": Site(
+        name="rostock",
+        home_url="https://www.hwk-omv.de/betriebe/suche-18,57,bdbsearch.html?search-searchterm=&search-filter-zipcode=Rostock&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-training=&search-filter-experience=",
+        base_url="https://www.hwk-omv.de",
+        cookie_domain=".hwk-omv.de",
+        list_url="https://www.hwk-omv.de/betriebe/suche-18,57,bdbsearch.html?limit={limit}&search-searchterm=&search-job=&search-local=&search-filter-zipcode=Rostock&search-filter-radius=250&search-filter-jobnr=&search-filter-training=&search-filter-experience=&offset={offset}",
+        total_pages=587,
+    ),
+    "koeln": Site(
+        name="koeln",
+        home_url="https://www.hwk-koeln.de/betriebe/suche-32,0,bdbsearch.html?search-searchterm=&search-filter-zipcode=50667&search-filter-radius=250&search-filter-jobnr=&search-job=&search-local=&search-filter-experience=",
+        base_url="https://www.hwk-koeln.de",
+        cookie_domain=".hwk-koeln.de",
+        list_url="https://www.hwk-koeln.de/betriebe/suche-32,0,bdbsearch.html?limit={limit}&search-searchterm=&search-job=&search-local=&search-filter-zipcode=50667&search-filter-latitude=50.941389&search-filter-longitude=6.953611&search-filter-radius=250&search-filter-jobnr=&search-filter-experience=&offset={offset}",
+        total_pages=2716,
+    ),
+}
+DEFAULT_SITE = "koeln"
+
+
+def load_sites(fpath: str) -> dict[str, Site]:
+    """
+    Returns the built-in profiles updated with the profiles of a JSON file holding a list of site objects.
+    """
+    sites = dict(SITES)
+    try:
+        with open(fpath, "r", encoding="utf-8") as f:
+            for jitem in json.load(f):
+                site = Site.from_json(jitem)
+                sites[site.name] = site
+    except:
+        log_err(f"failed to load site profiles from {fpath}")
+        traceback.print_exc()
+    return sites
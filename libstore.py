@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any
+
+from liblogger import log_inf
+
+DONE_MARKER_NAME = "done"
+
+
+class StateStore:
+    """
+    Page status and records of every site in one SQLite file in WAL mode.
+    Writes are buffered and committed in batches, a page is only committed as done
+    together with or after its records, so a crash at worst crawls the last batch again.
+    """
+
+    def __init__(self, fpath: str, batch_size: int = 200, batch_interval: float = 5.0):
+        self.__fpath = fpath
+        self.__batch_size = batch_size
+        self.__batch_interval = batch_interval
+        self.__lock = threading.Lock()
+        self.__records: list[tuple[str, int, int, str]] = []
+        self.__done: list[tuple[str, int, float]] = []
+        self.__flush_tstamp = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+        self.__conn = sqlite3.connect(fpath, timeout=30.0, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "site TEXT NOT NULL, page_index INTEGER NOT NULL, tstamp REAL NOT NULL, "
+            "PRIMARY KEY (site, page_index))"
+        )
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "site TEXT NOT NULL, page_index INTEGER NOT NULL, info_index INTEGER NOT NULL, info TEXT NOT NULL, "
+            "PRIMARY KEY (site, page_index, info_index))"
+        )
+        self.__conn.commit()
+
+    def __flush(self):
+        if len(self.__records) > 0 or len(self.__done) > 0:
+            with self.__conn:
+                self.__conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", self.__records)
+                self.__conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", self.__done)
+            self.__records = []
+            self.__done = []
+        self.__flush_tstamp = time.time()
+
+    def __maybe_flush(self):
+        if len(self.__records) >= self.__batch_size or time.time() - self.__flush_tstamp >= self.__batch_interval:
+            self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            self.__conn.close()
+
+    def done_pages(self, site: str) -> set[int]:
+        with self.__lock:
+            ret = set([row[0] for row in self.__conn.execute("SELECT page_index FROM pages WHERE site = ?", (site,))])
+            ret.update([page_index for name, page_index, _ in self.__done if name == site])
+        return ret
+
+    def is_done(self, site: str, page_index: int) -> bool:
+        with self.__lock:
+            if (site, page_index) in [(name, index) for name, index, _ in self.__done]:
+                return True
+            row = self.__conn.execute("SELECT 1 FROM pages WHERE site = ? AND page_index = ?", (site, page_index)).fetchone()
+        return row != None
+
+    def has_site(self, site: str) -> bool:
+        with self.__lock:
+            self.__flush()
+            row = self.__conn.execute("SELECT 1 FROM records WHERE site = ? UNION SELECT 1 FROM pages WHERE site = ?", (site, site)).fetchone()
+        return row != None
+
+    def record_indices(self, site: str, page_index: int) -> set[int]:
+        with self.__lock:
+            ret = set(
+                [
+                    row[0]
+                    for row in self.__conn.execute(
+                        "SELECT info_index FROM records WHERE site = ? AND page_index = ?",
+                        (site, page_index),
+                    )
+                ]
+            )
+            ret.update([info_index for name, index, info_index, _ in self.__records if name == site and index == page_index])
+        return ret
+
+    def put_record(self, site: str, page_index: int, info_index: int, info: dict[str, Any]):
+        with self.__lock:
+            self.__records.append((site, page_index, info_index, json.dumps(info)))
+            self.__maybe_flush()
+
+    def mark_done(self, site: str, page_index: int):
+        with self.__lock:
+            self.__done.append((site, page_index, time.time()))
+            self.__maybe_flush()
+
+    def sites(self) -> list[str]:
+        with self.__lock:
+            return [row[0] for row in self.__conn.execute("SELECT DISTINCT site FROM records ORDER BY site")]
+
+    def export(self, site: str, output_dir: str) -> int:
+        """
+        Writes the records of `site` in the page_XXXX/{i}.json layout with done markers. Returns the record count.
+        """
+        self.flush()
+        count = 0
+        with self.__lock:
+            rows = self.__conn.execute(
+                "SELECT page_index, info_index, info FROM records WHERE site = ? ORDER BY page_index, info_index",
+                (site,),
+            ).fetchall()
+            done_pages = set([row[0] for row in self.__conn.execute("SELECT page_index FROM pages WHERE site = ?", (site,))])
+
+        for page_index, info_index, info in rows:
+            page_dir = os.path.join(output_dir, ("page_%04d" % page_index))
+            os.makedirs(page_dir, exist_ok=True)
+            with open(os.path.join(page_dir, f"{info_index}.json"), "w") as f:
+                json.dump(json.loads(info), f, indent=2)
+            count += 1
+
+        for page_index in done_pages:
+            page_dir = os.path.join(output_dir, ("page_%04d" % page_index))
+            os.makedirs(page_dir, exist_ok=True)
+            with open(os.path.join(page_dir, DONE_MARKER_NAME), "w") as f:
+                f.write("done")
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports a crawl store to the page_XXXX/{i}.json directory layout.")
+    parser.add_argument(
+        "--store",
+        dest="store",
+        type=str,
+        required=True,
+        help="SQLite file written by crawler.py --store.",
+    )
+    parser.add_argument(
+        "--output",
+        dest="output",
+        type=str,
+        required=True,
+        help="Output folder. Every site is exported into <output>/<site> unless --site is given.",
+    )
+    parser.add_argument(
+        "--site",
+        dest="site",
+        type=str,
+        default="",
+        required=False,
+        help="Only export this site, directly into the output folder.",
+    )
+    args = parser.parse_args()
+
+    try:
+        store = StateStore(args.store)
+        if args.site != "":
+            targets = [(args.site, args.output)]
+        else:
+            targets = [(site, os.path.join(args.output, site)) for site in store.sites()]
+        for site, output_dir in targets:
+            count = store.export(site, output_dir)
+            log_inf(f"export: {site} > {output_dir}, {count} records")
+        store.close()
+    except:
+        traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ import traceback
 import numpy as np
 import pandas as pd
 
+from libsink import iter_records
+
 
 def natural_sort_key(s):
     """
@@ -55,6 +57,7 @@ def merge(src_dpath: str):
         )
 
         print(f"[*] merge: {src_dpath} > {dst_fpath}.*")
+        infos = []
         for dpath, _, fnames in os.walk(src_dpath):
             sorted_fnames = sorted(fnames, key=natural_sort_key)
             for fname in sorted_fnames:
@@ -63,38 +66,48 @@ def merge(src_dpath: str):
                     print(f"[*] filepath: {fpath[len(src_dpath):]}")
 
                     with open(fpath, mode="r") as f:
-                        info = json.load(f)
-                        res0_df = pd.concat([res0_df, pd.DataFrame([info])], ignore_index=True)
-                        res1_df = pd.concat(
-                            [
-                                res1_df,
-                                pd.DataFrame(
-                                    [
-                                        {
-                                            "email": info["email"],
-                                        }
-                                    ]
-                                ),
-                            ],
-                            ignore_index=True,
-                        )
-                        res2_df = pd.concat(
-                            [
-                                res2_df,
-                                pd.DataFrame(
-                                    [
-                                        {
-                                            "name": info["name"],
-                                            "address": info["address"],
-                                            "telephone": info["telephone"],
-                                            "mobile": info["mobile"],
-                                            "fax": info["fax"],
-                                        }
-                                    ]
-                                ),
-                            ],
-                            ignore_index=True,
-                        )
+                        infos.append(json.load(f))
+
+        # segments written by crawler.py --sink
+        record_count = 0
+        for entry in iter_records(src_dpath):
+            infos.append(entry["info"])
+            record_count += 1
+        if record_count > 0:
+            print(f"[*] jsonl records: {record_count}")
+
+        for info in infos:
+            res0_df = pd.concat([res0_df, pd.DataFrame([info])], ignore_index=True)
+            res1_df = pd.concat(
+                [
+                    res1_df,
+                    pd.DataFrame(
+                        [
+                            {
+                                "email": info["email"],
+                            }
+                        ]
+                    ),
+                ],
+                ignore_index=True,
+            )
+            res2_df = pd.concat(
+                [
+                    res2_df,
+                    pd.DataFrame(
+                        [
+                            {
+                                "name": info["name"],
+                                "address": info["address"],
+                                "telephone": info["telephone"],
+                                "mobile": info["mobile"],
+                                "fax": info["fax"],
+                            }
+                        ]
+                    ),
+                ],
+                ignore_index=True,
+            )
         res0_df.to_excel(dst_fpath+"_0.xlsx", index=False)
         res1_df.to_excel(dst_fpath+"_1.xlsx", index=False)
         res2_df.to_excel(dst_fpath+"_2.xlsx", index=False)
@@ -0,0 +1,338 @@
+import argparse
+import multiprocessing
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import Connection
+from multiprocessing.connection import wait as wait_ready
+from typing import Any, Optional
+
+import crawler
+from liblogger import log_err, log_inf
+
+PROGRESS_INTERVAL = 30.0
+# times a page is handed out before a page failing in crawl_page is given up
+PAGE_ATTEMPTS = 2
+
+
+def worker_main(worker_id: int, args: argparse.Namespace, conn: Connection):
+    """
+    Crawls the pages the orchestrator hands out, one at a time, with its own browser per site.
+    Every request for the next page reports the previous page and whether it was crawled.
+    """
+    try:
+        crawler.setup(args)
+        crawls: dict[str, crawler.SiteCrawl] = {}
+        finished_task = None
+        while True:
+            conn.send(finished_task)
+            task = conn.recv()
+            if task == None:
+                break
+
+            site_name, page_index = task
+            crawl = crawls.get(site_name)
+            if crawl == None:
+                site = [site for site in args.sites if site.name == site_name][0]
+                crawl = crawler.SiteCrawl(site=site, output_dir=crawler.site_output_dir(site, args))
+                crawler.open_site(crawl, args)
+                crawls[site_name] = crawl
+
+            crawled = crawler.crawl_page(crawl, page_index, crawler.gen_page_url(crawl, page_index))
+            # a page reported as finished must not be lost with the batch of a crashing worker
+            if crawler.STORE != None:
+                crawler.STORE.flush()
+            finished_task = (task, crawled)
+
+        for crawl in crawls.values():
+            crawler.close_site(crawl)
+        crawler.teardown()
+        log_inf(f"worker {worker_id}: done.")
+    except:
+        traceback.print_exc()
+
+
+class Worker:
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.shard: deque[tuple[str, int]] = deque()
+        self.task: Optional[tuple[str, int]] = None
+        self.task_tstamp = 0.0
+        self.done_count = 0
+        self.restarts = 0
+        self.waiting = False
+        self.finished = False
+
+    def is_alive(self) -> bool:
+        return self.process != None and not self.finished
+
+
+class Orchestrator:
+    """
+    Splits the pages of every site into one shard per worker process and supervises the workers.
+    A worker whose shard runs dry steals half of the largest remaining shard, a dead or stalled
+    worker is restarted and its in-flight page is queued again.
+    """
+
+    def __init__(self, args: argparse.Namespace, workers: int, stall_timeout: float, max_restarts: int):
+        self.__args = args
+        self.__workers = [Worker(worker_id=i) for i in range(max(workers, 1))]
+        self.__stall_timeout = stall_timeout
+        self.__max_restarts = max_restarts
+        self.__total_count = 0
+        self.__done_count = 0
+        self.__attempts: dict[tuple[str, int], int] = {}
+        self.__failed: list[tuple[str, int]] = []
+        self.__start_tstamp = 0.0
+        self.__progress_tstamp = 0.0
+
+    def __plan(self) -> list[tuple[str, int]]:
+        tasks = []
+        crawler.setup(self.__args)
+        for site in self.__args.sites:
+            crawl = crawler.SiteCrawl(site=site, output_dir=crawler.site_output_dir(site, self.__args))
+            if self.__args.probe:
+                # probe once here so that every worker reuses the stored plan
+                crawler.open_site(crawl, self.__args)
+                crawler.close_site(crawl)
+            else:
+                crawl.page_size, crawl.total_pages = crawler.load_plan(crawl, probe=False)
+
+            begin_page = self.__args.start
+            end_page = min(crawl.total_pages, self.__args.start + self.__args.count)
+            if self.__args.count == 0:
+                end_page = crawl.total_pages
+
+            for page_index in crawler.pending_pages(crawl, begin_page, end_page):
+                tasks.append((site.name, page_index))
+        # the workers open the store on their own
+        crawler.teardown()
+        return tasks
+
+    def __spawn(self, worker: Worker):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        worker.process = multiprocessing.Process(
+            target=worker_main,
+            args=(worker.worker_id, self.__args, child_conn),
+            daemon=True,
+        )
+        worker.process.start()
+        worker.conn = parent_conn
+        worker.waiting = False
+        worker.finished = False
+        log_inf(f"worker {worker.worker_id}: started, {len(worker.shard)} pages in shard")
+
+    def __steal(self, thief: Worker) -> bool:
+        victim = max(self.__workers, key=lambda worker: len(worker.shard))
+        if len(victim.shard) == 0:
+            return False
+
+        # take the back half, the victim keeps working on the front of its shard
+        steal_count = max(1, len(victim.shard) // 2)
+        stolen = [victim.shard.pop() for _ in range(steal_count)]
+        thief.shard.extend(reversed(stolen))
+        log_inf(f"worker {thief.worker_id}: stole {steal_count} pages from worker {victim.worker_id}")
+        return True
+
+    def __in_flight(self) -> bool:
+        return any([worker.task != None for worker in self.__workers])
+
+    def __dispatch(self, worker: Worker):
+        if len(worker.shard) == 0:
+            self.__steal(worker)
+
+        if len(worker.shard) > 0:
+            worker.task = worker.shard.popleft()
+            worker.task_tstamp = time.time()
+            worker.waiting = False
+            worker.conn.send(worker.task)
+        elif self.__in_flight():
+            # an in-flight page may still come back from a dead worker, keep this one waiting
+            worker.waiting = True
+        else:
+            worker.waiting = False
+            worker.finished = True
+            worker.conn.send(None)
+
+    def __on_finished(self, worker: Worker, finished: Any):
+        if finished == None:
+            return
+        task, crawled = finished
+        if task != worker.task:
+            return
+
+        worker.task = None
+        if crawled:
+            worker.done_count += 1
+            self.__done_count += 1
+            return
+
+        attempts = self.__attempts.get(task, 0) + 1
+        self.__attempts[task] = attempts
+        if attempts < PAGE_ATTEMPTS:
+            # to the back of the shard, so the page is tried again after the others or by a thief
+            log_err(f"worker {worker.worker_id}: failed on {task}, queued again")
+            worker.shard.append(task)
+        else:
+            log_err(f"worker {worker.worker_id}: failed on {task}, given up after {attempts} attempts")
+            self.__failed.append(task)
+
+    def __on_dead(self, worker: Worker):
+        if worker.task != None:
+            worker.shard.appendleft(worker.task)
+            worker.task = None
+
+        if worker.restarts < self.__max_restarts:
+            worker.restarts += 1
+            log_err(f"worker {worker.worker_id}: died, restart {worker.restarts}/{self.__max_restarts}")
+            self.__spawn(worker)
+        else:
+            log_err(f"worker {worker.worker_id}: died, its {len(worker.shard)} pages are left to the others")
+            worker.process = None
+            worker.finished = True
+
+        # pages went back to the queue, wake up the idle workers
+        self.__wake_waiting()
+
+    def __wake_waiting(self):
+        for worker in self.__workers:
+            if worker.is_alive() and worker.waiting:
+                self.__dispatch(worker)
+
+    def __check_stalled(self):
+        now = time.time()
+        for worker in self.__workers:
+            if worker.is_alive() and worker.task != None and now - worker.task_tstamp > self.__stall_timeout:
+                log_err(f"worker {worker.worker_id}: stalled on {worker.task}, terminate")
+                worker.process.terminate()
+
+    def __report(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.__progress_tstamp < PROGRESS_INTERVAL:
+            return
+        self.__progress_tstamp = now
+
+        elapsed = max(now - self.__start_tstamp, 1.0)
+        speed = self.__done_count / elapsed * 60.0
+        remain = self.__total_count - self.__done_count
+        eta = f"{remain / speed / 60.0:.1f}h" if speed > 0 else "?"
+        percent = self.__done_count * 100.0 / max(self.__total_count, 1)
+        log_inf(
+            f"progress: {self.__done_count}/{self.__total_count} pages ({percent:.1f}%), {speed:.1f} pages/min, eta {eta}\n"
+            + "\n".join(
+                [
+                    f"worker {worker.worker_id}: {worker.done_count} done, {len(worker.shard)} queued, on {worker.task}"
+                    + ("" if worker.is_alive() else " (stopped)")
+                    for worker in self.__workers
+                ]
+            )
+        )
+
+    def run(self):
+        tasks = self.__plan()
+        self.__total_count = len(tasks)
+        log_inf(f"orchestrator: {self.__total_count} pages left for {len(self.__workers)} workers")
+        if self.__total_count == 0:
+            return
+
+        # contiguous shards, so each worker walks its own page range
+        shard_size = (len(tasks) + len(self.__workers) - 1) // len(self.__workers)
+        for i, worker in enumerate(self.__workers):
+            worker.shard.extend(tasks[i * shard_size : (i + 1) * shard_size])
+
+        self.__start_tstamp = time.time()
+        for worker in self.__workers:
+            self.__spawn(worker)
+
+        while any([worker.is_alive() for worker in self.__workers]):
+            alive_workers = [worker for worker in self.__workers if worker.is_alive()]
+            handles = [worker.conn for worker in alive_workers] + [worker.process.sentinel for worker in alive_workers]
+            ready = wait_ready(handles, timeout=5.0)
+
+            for worker in alive_workers:
+                if worker.conn in ready:
+                    try:
+                        self.__on_finished(worker, worker.conn.recv())
+                        self.__dispatch(worker)
+                    except (EOFError, OSError):
+                        pass
+            self.__wake_waiting()
+
+            for worker in alive_workers:
+                if worker.process.sentinel in ready and not worker.finished:
+                    self.__on_dead(worker)
+
+            self.__check_stalled()
+            self.__report()
+
+        for worker in self.__workers:
+            if worker.process != None:
+                worker.process.join(timeout=60.0)
+
+        self.__report(force=True)
+        if self.__done_count < self.__total_count:
+            log_err(f"orchestrator: {self.__total_count - self.__done_count} pages were not crawled, {len(self.__failed)} of them failed")
+            for site_name, page_index in sorted(self.__failed):
+                log_err(f"orchestrator: {site_name} page {page_index} failed")
+        log_inf("All done.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs crawler.py in several worker processes. Arguments not listed here are crawler arguments."
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        required=False,
+        help="Number of worker processes, each with its own Chrome. Default is the number of cores.",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        dest="stall_timeout",
+        type=float,
+        default=1800.0,
+        required=False,
+        help="Seconds a worker may spend on one page before it is restarted. Default is 1800.",
+    )
+    parser.add_argument(
+        "--restarts",
+        dest="restarts",
+        type=int,
+        default=3,
+        required=False,
+        help="Times a dead worker is restarted. Default is 3.",
+    )
+    orchestrator_args, crawler_argv = parser.parse_known_args()
+    args = crawler.parse_args(crawler_argv)
+    if args.queue != "":
+        parser.error("--queue shares pages between crawler.py processes, run crawler.py on every node instead")
+    if args.reextract or args.retry_failed:
+        parser.error("--reextract and --retry-failed are single runs, run crawler.py instead")
+    if args.pipeline:
+        parser.error("--pipeline runs all pages of a site in one process, run crawler.py --pipeline instead")
+    if args.parse_processes > 0:
+        parser.error("--parse-processes needs child processes, which the worker processes cannot have")
+
+    # the rate limits are per process, split the budget so all workers together keep the requested rate
+    args.rate /= orchestrator_args.workers
+    args.min_rate /= orchestrator_args.workers
+    args.max_rate /= orchestrator_args.workers
+    log_inf(f"rate: {args.rate:.3f} req/s per host and worker, adapting in [{args.min_rate:.3f}, {args.max_rate:.3f}]")
+
+    Orchestrator(
+        args=args,
+        workers=orchestrator_args.workers,
+        stall_timeout=orchestrator_args.stall_timeout,
+        max_restarts=orchestrator_args.restarts,
+    ).run()
+    input("Press ENTER to exit.")
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()